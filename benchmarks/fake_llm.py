@@ -0,0 +1,72 @@
+import random
+import threading
+import time
+
+class Message:
+    def __init__(self, content):
+        self.content = content
+
+class Choice:
+    def __init__(self, content):
+        self.message = Message(content)
+        self.delta = Message(content)
+
+class Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.prompt_tokens_details = None
+
+class Completion:
+    def __init__(self, content, usage=None):
+        self.choices = [Choice(content)]
+        self.usage = usage
+
+class FakeCompletions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, messages, stream=False, **kwargs):
+        return self.client.respond(messages, stream)
+
+class FakeChat:
+    def __init__(self, client):
+        self.completions = FakeCompletions(client)
+
+class FakeInferenceClient:
+    def __init__(self, responses, latency=0.0, jitter=0.0, tokens_per_second=None, seed=0):
+        self.responses = list(responses)
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.chat = FakeChat(self)
+
+    def next_response(self, messages):
+        with self.lock:
+            index = self.calls
+            self.calls += 1
+        if callable(self.responses[0]):
+            return self.responses[0](messages, index)
+        return self.responses[min(index, len(self.responses) - 1)]
+
+    def respond(self, messages, stream):
+        content = self.next_response(messages)
+        time.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+        usage = Usage(prompt_tokens, len(content) // 4)
+        if not stream:
+            if self.tokens_per_second:
+                time.sleep(len(content) / 4 / self.tokens_per_second)
+            return Completion(content, usage)
+        return self.stream_chunks(content, usage)
+
+    def stream_chunks(self, content, usage):
+        chunk_size = 16
+        for start in range(0, len(content), chunk_size):
+            if self.tokens_per_second:
+                time.sleep(chunk_size / 4 / self.tokens_per_second)
+            yield Completion(content[start:start + chunk_size])
+        yield Completion(None, usage)
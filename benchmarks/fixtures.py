@@ -0,0 +1,86 @@
+import os
+import random
+
+WORDS = (
+    "search results news video shopping maps images account settings privacy help sign in "
+    "product price review rating delivery cart checkout offer deal category brand color size "
+    "article story report update world business technology science health sports travel"
+).split()
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+def page(title, head, body):
+    return f"<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\"><title>{title}</title>{head}</head><body>{body}</body></html>"
+
+def inline_assets(rng, scripts, styles):
+    parts = []
+    for index in range(styles):
+        rules = ''.join(f".c{index}-{n}{{margin:{n}px;padding:{n % 7}px;color:#{rng.randrange(0x1000000):06x}}}" for n in range(200))
+        parts.append(f"<style>{rules}</style>")
+    for index in range(scripts):
+        body = ';'.join(f"var v{index}_{n}=function(a,b){{return a<b?'{words(rng, 3)}':b>a}}" for n in range(300))
+        parts.append(f"<script>{body}</script>")
+    return ''.join(parts)
+
+def navigation(rng, links):
+    items = ''.join(f'<li class="nav-item"><a href="/section/{n}" class="nav-link">{words(rng, 2)}</a></li>' for n in range(links))
+    return f'<header class="site-header"><nav role="navigation"><ul class="nav">{items}</ul></nav></header>'
+
+def search_form(placeholder="Search"):
+    return (
+        '<form action="search.html" role="search" class="search-form">'
+        f'<input type="text" name="q" id="search-input" class="search-box" aria-label="Search" placeholder="{placeholder}" autocomplete="off">'
+        '<button type="submit" class="btn search-button" aria-label="Search">Search</button>'
+        '</form>'
+    )
+
+def search_results_page(rng, results=120):
+    cards = ''.join(
+        f'<div class="g result" data-rank="{n}"><div class="r"><div class="r"><a href="https://example{n}.com/{words(rng, 1)}">'
+        f'<h3 class="title">{words(rng, 6)}</h3></a></div></div><div class="snippet"><span>{words(rng, 40)}</span></div>'
+        f'<div class="actions"><button class="more" aria-label="More options">More</button></div></div>'
+        for n in range(results)
+    )
+    body = navigation(rng, 40) + search_form() + f'<main id="results">{cards}</main>'
+    return page("Search results", inline_assets(rng, 12, 6), body)
+
+def product_listing_page(rng, products=300):
+    cards = ''.join(
+        f'<div class="product-card" data-sku="{n}"><div class="media"><div class="frame"><img src="/img/{n}.jpg" alt="{words(rng, 3)}"></div></div>'
+        f'<div class="details"><a class="product-title" href="/product/{n}">{words(rng, 8)}</a><span class="price">${rng.randrange(5, 900)}.99</span>'
+        f'<div class="rating" role="img" aria-label="{rng.randrange(1, 5)} out of 5 stars"></div>'
+        f'<button class="btn add-to-cart" type="button">Add to cart</button></div></div>'
+        for n in range(products)
+    )
+    filters = ''.join(f'<label><input type="checkbox" name="brand" value="{n}">{words(rng, 1)}</label>' for n in range(80))
+    body = navigation(rng, 60) + search_form("Search products") + f'<aside class="filters">{filters}</aside><section class="grid">{cards}</section>'
+    return page("Products", inline_assets(rng, 20, 10), body)
+
+def article_page(rng, paragraphs=400):
+    text = ''.join(f'<p>{words(rng, 60)} <a href="/topic/{n}">{words(rng, 2)}</a></p>' for n in range(paragraphs))
+    comments = ''.join(
+        f'<div class="comment"><span class="author">{words(rng, 1)}</span><p>{words(rng, 25)}</p>'
+        f'<button class="reply" type="button">Reply</button></div>'
+        for n in range(150)
+    )
+    consent = '<div class="cookie-consent"><p>We use cookies.</p><button class="accept">Accept All</button></div>'
+    body = consent + navigation(rng, 80) + search_form() + f'<article>{text}</article><section class="comments">{comments}</section>'
+    return page("Article", inline_assets(rng, 25, 8), body)
+
+PAGES = {
+    "search.html": search_results_page,
+    "products.html": product_listing_page,
+    "article.html": article_page,
+}
+
+def generate_pages(directory, seed=1234):
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, build in PAGES.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(build(random.Random(f"{seed}-{name}")))
+        paths[name] = path
+    return paths
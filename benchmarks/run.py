@@ -0,0 +1,201 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from html.parser import HTMLParser
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import main as agent
+from fake_llm import FakeInferenceClient
+from fixtures import generate_pages
+from server import serve
+
+PAGES_DIR = os.path.join(BENCHMARK_DIR, "pages")
+SCENARIOS_PATH = os.path.join(BENCHMARK_DIR, "scenarios.json")
+
+ABSOLUTE_SLACK = {"median_ms": 0.5, "wall_seconds": 0.25}
+
+JSON_SAMPLES = [
+    '{"actions": [{"action": "navigate", "url": "https://www.google.com"}]}',
+    'Here is the plan:\n```json\n{"actions": [{"action": "type", "text": "books", "use_previous_element": true}]}\n```',
+    'Sure! {"actions": [' + ', '.join('{"action": "scroll", "direction": "down", "amount": %d}' % n for n in range(40)) + ']} Let me know.',
+    'I could not produce a plan for this page.',
+]
+
+class StackRecorder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.stacks = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in agent.VOID_TAGS:
+            if tag in agent.INTERACTIVE_TAGS:
+                self.stacks.append(list(self.stack))
+            return
+        self.stack.append((tag, dict(attrs)))
+        if tag in agent.INTERACTIVE_TAGS:
+            self.stacks.append(list(self.stack))
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+
+def element_stacks(html):
+    recorder = StackRecorder()
+    recorder.feed(html)
+    return recorder.stacks
+
+def measure(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return {"min_ms": min(samples) * 1000, "median_ms": statistics.median(samples) * 1000}
+
+def run_micro(pages, repeat):
+    results = {}
+    for name, path in pages.items():
+        with open(path, 'r', encoding='utf-8') as f:
+            html = f.read()
+        page = os.path.splitext(name)[0]
+        stacks = element_stacks(html)
+        results[f"preprocess_html.{page}"] = measure(lambda: agent.preprocess_html(html), repeat)
+        results[f"collect_all_elements.{page}"] = measure(lambda: agent.collect_interactive_elements(html, max_chars=10 ** 9), repeat)
+        results[f"get_element_location.{page}"] = measure(lambda: [agent.get_element_location(stack) for stack in stacks], repeat)
+    results["extract_json_from_text"] = measure(lambda: [agent.extract_json_from_text(sample) for sample in JSON_SAMPLES * 50], repeat)
+    return results
+
+def scenario_responses(scenario, base_url):
+    return [json.dumps(response).replace("{base_url}", base_url) for response in scenario["responses"]]
+
+def run_e2e(scenarios, base_url, repeat, latency, verbose):
+    pool = agent.BrowserPool(1)
+    results = {}
+    try:
+        for scenario in scenarios:
+            runs = []
+            for _ in range(repeat):
+                driver = pool.acquire()
+                session = agent.AgentSession(driver)
+                agent.activate_session(session)
+                driver.get("about:blank")
+                agent.popup_memo.clear()
+                fake_client = FakeInferenceClient(scenario_responses(scenario, base_url), latency=latency)
+                agent.client = agent.LLMGateway([fake_client], hedge=False)
+                output = io.StringIO()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(sys.stdout if verbose else output):
+                    result = agent.run_task(scenario["instruction"])
+                wall = time.perf_counter() - start
+                pool.release(driver)
+                runs.append({"wall_seconds": wall, "result": result, "llm_calls": fake_client.calls})
+            walls = [run["wall_seconds"] for run in runs]
+            last = runs[-1]["result"]
+            results[scenario["name"]] = {
+                "status": last["status"],
+                "iterations": max(run["result"]["iterations"] for run in runs),
+                "llm_calls": max(run["llm_calls"] for run in runs),
+                "wall_seconds": statistics.median(walls),
+                "timings": last.get("timings", {}),
+            }
+    finally:
+        pool.close()
+    return results
+
+def flatten(report):
+    metrics = {}
+    for name, values in report.get("micro", {}).items():
+        metrics[f"micro.{name}.median_ms"] = values["median_ms"]
+    for name, values in report.get("e2e", {}).items():
+        metrics[f"e2e.{name}.wall_seconds"] = values["wall_seconds"]
+        metrics[f"e2e.{name}.iterations"] = values["iterations"]
+        metrics[f"e2e.{name}.llm_calls"] = values["llm_calls"]
+    return metrics
+
+def compare(report, baseline, tolerance):
+    current = flatten(report)
+    regressions = []
+    for key, previous in flatten(baseline).items():
+        value = current.get(key)
+        if value is None:
+            continue
+        if key.endswith((".iterations", ".llm_calls")):
+            limit = previous
+        else:
+            limit = previous * (1 + tolerance) + ABSOLUTE_SLACK[key.rsplit(".", 1)[1]]
+        if value > limit:
+            regressions.append(f"{key}: {value:.3f} (baseline {previous:.3f})")
+    for name, values in report.get("e2e", {}).items():
+        if values["status"] != "completed":
+            regressions.append(f"e2e.{name}: status {values['status']}")
+    return regressions
+
+def print_report(report):
+    for name, values in report.get("micro", {}).items():
+        print(f"{name:<40} median {values['median_ms']:9.2f} ms   min {values['min_ms']:9.2f} ms")
+    for name, values in report.get("e2e", {}).items():
+        phases = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in sorted(values["timings"].items(), key=lambda item: -item[1]) if phase != "task")
+        print(f"{name:<40} {values['status']:<10} {values['wall_seconds']:6.2f}s  {values['iterations']} iterations  {values['llm_calls']} LLM calls  [{phases}]")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline WePilot benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--e2e-repeat", type=int, default=1)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated LLM latency in seconds")
+    parser.add_argument("--pacing", choices=["fast", "humanized"], default="fast")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="compare against a previous --output report and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    agent.PLAN_REPLAY_ENABLED = False
+    agent.LLM_CACHE_ENABLED = False
+    agent.SELECTOR_CACHE_ENABLED = False
+    agent.FAST_LOAD = True
+    agent.PACING_PROFILE = args.pacing
+    agent.TRACE_DIR = None
+
+    pages = generate_pages(PAGES_DIR)
+    report = {"created": time.time(), "pacing": args.pacing, "latency": args.latency}
+    if not args.skip_micro:
+        report["micro"] = run_micro(pages, args.repeat)
+    if not args.skip_e2e:
+        with open(SCENARIOS_PATH, 'r', encoding='utf-8') as f:
+            scenarios = json.load(f)
+        server, base_url = serve(PAGES_DIR)
+        try:
+            report["e2e"] = run_e2e(scenarios, base_url, args.e2e_repeat, args.latency, args.verbose)
+        finally:
+            server.shutdown()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory, port=0):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="benchmark-http", daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -5,24 +5,181 @@ from selenium.webdriver.common.by import By
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import wait as wait_connections
+from urllib.parse import parse_qs, quote, quote_plus, urljoin, urlparse
+import argparse
+import base64
+import contextlib
+import gzip
+import hashlib
+import html as html_entities
+import http.client
 import json
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+import sys
+import threading
 import time
 import re
 import random
+import zlib
 
-client = InferenceClient(
-    model="deepseek-ai/DeepSeek-V3-0324",
-    provider="novita",
-)
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+LLM_ENDPOINTS = [
+    {"model": "deepseek-ai/DeepSeek-V3-0324", "provider": "novita"},
+]
+LLM_RATE_LIMIT = 2.0
+LLM_RATE_BURST = 5
+LLM_MAX_ATTEMPTS = 3
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+LLM_HEDGE_ENABLED = True
+LLM_HEDGE_QUANTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_MAX_IN_FLIGHT = 64
+
+HTML_PARSER_BACKEND = "lxml" if lxml_etree is not None else "html.parser"
+HTML_FEED_CHUNK_SIZE = 16384
+ELEMENT_EXTRACTOR = "html"
+INCREMENTAL_SNAPSHOTS = False
+ELEMENT_HANDLES = True
+HANDLE_ATTRIBUTE = "data-wp-id"
+MAX_REGISTERED_HANDLES = 2000
+LOCATOR_POLL_INTERVAL = 0.1
+DELTA_MAX_RATIO = 0.5
+DELTA_MAX_CHAIN = 3
+ELEMENT_ENCODING = "ranked"
+ELEMENT_TOKEN_BUDGET = 1200
+ELEMENT_CANDIDATE_CHARS = 60000
+LLM_CACHE_ENABLED = True
+LLM_CACHE_SIZE = 256
+LLM_CACHE_PATH = None
+LLM_CACHE_TTL = 24 * 3600
+LLM_CACHE_MAX_DISK_ENTRIES = 10000
+STREAM_LLM_RESPONSES = False
+STRUCTURED_OUTPUT = True
+SPECULATIVE_PREFETCH = True
+HISTORY_TOKEN_BUDGET = 4000
+HISTORY_DIGEST_LINES = 30
+PLAN_REPLAY_ENABLED = True
+PLAN_STORE_PATH = "wepilot_plans.json"
+SELECTOR_CACHE_ENABLED = True
+SELECTOR_CACHE_PATH = "wepilot_selectors.json"
+SELECTOR_CACHE_MAX_ENTRIES = 5000
+SELECTOR_MIN_CONFIDENCE = 0.5
+SELECTOR_MAX_MISSES = 3
+MAX_CONCURRENT_SESSIONS = 4
+MAX_ITERATIONS = 10
+WARM_BROWSERS = 0
+BROWSER_MAX_TASKS = 50
+BROWSER_MAX_HEAP_MB = 1024
+BROWSER_POOL_POLL_SECONDS = 1
+JOB_SERVER_HOST = "127.0.0.1"
+JOB_SERVER_PORT = 8765
+JOB_QUEUE_LIMIT = 100
+JOB_AFFINITY_WINDOW = 10
+JOB_HISTORY_LIMIT = 1000
+JOB_PROGRESS_SPANS = ("llm_request", "action")
+PACING_PROFILE = "humanized"
+READY_TIMEOUT = 5
+SETTLE_TIMEOUT = 2
+NETWORK_IDLE_MS = 500
+DOM_QUIET_MS = 200
+SCREENSHOT_DIR = "wepilot_screenshots"
+SCREENSHOTS_PER_SESSION = 20
+SCREENSHOTS_MAX_TOTAL = 500
+SCREENSHOT_MIN_INTERVAL = 2.0
+SCREENSHOT_FORMAT = "jpeg"
+SCREENSHOT_QUALITY = 60
+SCREENSHOT_SCALE = 0.5
+TRACE_ENABLED = True
+TRACE_DIR = None
+TRACE_MAX_EVENTS = 20000
+METRICS_HISTOGRAM_SIZE = 1000
+BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+FETCH_MODE = "browser"
+FAST_PATH_MAX_PAGES = 3
+FAST_PATH_MIN_ELEMENTS = 5
+FAST_PATH_MAX_BYTES = 2 * 1024 * 1024
+FAST_PATH_TIMEOUT = 10
+FAST_PATH_MAX_REDIRECTS = 5
+FAST_PATH_IDLE_CONNECTIONS = 4
+FAST_PATH_JS_MARKERS = [
+    r"<noscript[^>]*>[^<]{0,200}(enable|requires?|turn on)\s+javascript",
+    r"<(div|main)\s+id=[\"'](root|app|__next|__nuxt)[\"'][^>]*>\s*</\1>",
+    r"(cf-challenge|captcha|challenge-platform|px-captcha)",
+]
+FAST_LOAD = False
+FAST_LOAD_BLOCK_TYPES = ("image", "media", "font")
+FAST_LOAD_DENY_URLS = [
+    "*doubleclick.net*",
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*googlesyndication.com*",
+    "*adservice.google.*",
+    "*connect.facebook.net*",
+    "*hotjar.com*",
+    "*scorecardresearch.com*",
+    "*criteo.com*",
+    "*taboola.com*",
+    "*outbrain.com*",
+]
+FAST_LOAD_ALLOW_URLS = []
+RESOURCE_TYPE_PATTERNS = {
+    "image": ["*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.ico*", "*.bmp*"],
+    "media": ["*.mp4*", "*.webm*", "*.m3u8*", "*.mp3*", "*.ogg*", "*.wav*", "*.m4a*"],
+    "font": ["*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*"],
+}
 
-def configure_browser():
+def fast_load_blocked_urls():
+    patterns = []
+    for resource_type in FAST_LOAD_BLOCK_TYPES:
+        patterns.extend(RESOURCE_TYPE_PATTERNS.get(resource_type, []))
+    patterns.extend(FAST_LOAD_DENY_URLS)
+    return [pattern for pattern in dict.fromkeys(patterns) if pattern not in FAST_LOAD_ALLOW_URLS]
+
+def apply_resource_blocking(driver):
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": fast_load_blocked_urls()})
+
+def configure_browser(fast_load=None):
+    fast_load = FAST_LOAD if fast_load is None else fast_load
     options = webdriver.ChromeOptions()
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    options.add_argument(f"user-agent={BROWSER_USER_AGENT}")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
     options.add_argument("--disable-blink-features=AutomationControlled")
     
+    if fast_load:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1366,900")
+        if "image" in FAST_LOAD_BLOCK_TYPES:
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    
     driver = webdriver.Chrome(options=options)
     driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
         "source": """
@@ -31,96 +188,570 @@ def configure_browser():
         })
         """
     })
+    if PACING_PROFILE == "fast":
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": ACTIVITY_TRACKER_JS})
+    if fast_load:
+        apply_resource_blocking(driver)
     return driver
 
-driver = configure_browser()
+def report_navigation_savings(driver):
+    if not FAST_LOAD:
+        return None
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return None
+    report = {"blocked_requests": 0, "loaded_requests": 0, "transferred_bytes": 0, "blocked_by_type": {}}
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, TypeError, json.JSONDecodeError):
+            continue
+        params = message.get("params", {})
+        if message.get("method") == "Network.loadingFinished":
+            report["loaded_requests"] += 1
+            report["transferred_bytes"] += int(params.get("encodedDataLength", 0))
+        elif message.get("method") == "Network.loadingFailed" and params.get("blockedReason"):
+            resource_type = params.get("type", "Other")
+            report["blocked_requests"] += 1
+            report["blocked_by_type"][resource_type] = report["blocked_by_type"].get(resource_type, 0) + 1
+    blocked_types = ', '.join(f"{name}={count}" for name, count in report["blocked_by_type"].items()) or "none"
+    print(f"Fast load: {report['blocked_requests']} requests blocked ({blocked_types}), {report['loaded_requests']} loaded, {report['transferred_bytes'] / 1024:.0f} KB transferred")
+    savings = current_session().network_savings
+    for key in ("blocked_requests", "loaded_requests", "transferred_bytes"):
+        savings[key] += report[key]
+    return report
+
+class BrowserPool:
+    def __init__(self, max_browsers, warm_size=0, max_tasks_per_browser=None, max_heap_mb=None):
+        self.max_browsers = max_browsers
+        self.warm_size = min(warm_size, max_browsers)
+        self.max_tasks_per_browser = max_tasks_per_browser if max_tasks_per_browser is not None else BROWSER_MAX_TASKS
+        self.max_heap_mb = max_heap_mb if max_heap_mb is not None else BROWSER_MAX_HEAP_MB
+        self.idle = queue.LifoQueue()
+        self.task_counts = {}
+        self.created = 0
+        self.lock = threading.Lock()
+        self.stats = {"acquires": 0, "acquire_seconds": 0.0, "max_acquire_seconds": 0.0, "launched": 0, "resets": 0, "recycled": 0}
+        if self.warm_size:
+            self.warm()
 
-conversation_history = []
+    def warm(self, count=None):
+        target = self.warm_size if count is None else count
+        with self.lock:
+            missing = max(0, min(target - self.idle.qsize(), self.max_browsers - self.created))
+            self.created += missing
+        for _ in range(missing):
+            threading.Thread(target=self._launch_idle, name="wepilot-browser-warmup", daemon=True).start()
 
-def preprocess_html(html, max_chars=5000):
-    soup = BeautifulSoup(html, 'html.parser')
-    
-    for tag in ['script', 'style', 'meta', 'link', 'noscript', 'svg']:
-        for element in soup.find_all(tag):
-            element.decompose()
-
-    search_inputs = []
-    search_patterns = [
-        {'type': 'search'},
-        {'name': 'q'},
-        {'placeholder': lambda x: x and isinstance(x, str) and 'search' in x.lower()},
-        {'aria-label': lambda x: x and isinstance(x, str) and 'search' in x.lower()},
-        {'class': lambda x: x and (isinstance(x, str) and ('search' in x.lower() or 'query' in x.lower()))},
-        {'id': lambda x: x and isinstance(x, str) and ('search' in x.lower() or 'query' in x.lower())}
+    def _launch(self):
+        try:
+            driver = configure_browser()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+        with self.lock:
+            self.task_counts[id(driver)] = 0
+            self.stats["launched"] += 1
+        return driver
+
+    def _launch_idle(self):
+        try:
+            self.idle.put(self._launch())
+        except Exception as e:
+            print(f"Could not pre-launch browser: {str(e)}")
+
+    def acquire(self):
+        started = time.time()
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+                break
+            except queue.Empty:
+                pass
+            with self.lock:
+                can_create = self.created < self.max_browsers
+                if can_create:
+                    self.created += 1
+            if can_create:
+                driver = self._launch()
+                break
+            try:
+                driver = self.idle.get(timeout=BROWSER_POOL_POLL_SECONDS)
+                break
+            except queue.Empty:
+                pass
+        waited = time.time() - started
+        with self.lock:
+            self.stats["acquires"] += 1
+            self.stats["acquire_seconds"] += waited
+            self.stats["max_acquire_seconds"] = max(self.stats["max_acquire_seconds"], waited)
+        return driver
+
+    def count_task(self, driver):
+        with self.lock:
+            self.task_counts[id(driver)] = self.task_counts.get(id(driver), 0) + 1
+            tasks = self.task_counts[id(driver)]
+        heap_mb = browser_heap_mb(driver)
+        if tasks >= self.max_tasks_per_browser or (heap_mb is not None and heap_mb > self.max_heap_mb):
+            print(f"Recycling browser after {tasks} tasks ({heap_mb or 0:.0f} MB JS heap)")
+            return True
+        return False
+
+    def recycle(self, driver):
+        self.discard(driver)
+        self.warm()
+
+    def release(self, driver, count_task=True):
+        if count_task and self.count_task(driver):
+            self.recycle(driver)
+            return
+        try:
+            reset_browser(driver)
+            with self.lock:
+                self.stats["resets"] += 1
+            self.idle.put(driver)
+        except Exception as e:
+            print(f"Browser reset failed: {str(e)}, recycling it")
+            self.recycle(driver)
+
+    def discard(self, driver):
+        forget_origins(driver)
+        with self.lock:
+            self.task_counts.pop(id(driver), None)
+            self.created -= 1
+            self.stats["recycled"] += 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update({"browsers": self.created, "idle": self.idle.qsize()})
+        stats["avg_acquire_seconds"] = stats["acquire_seconds"] / stats["acquires"] if stats["acquires"] else 0.0
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+def browser_heap_mb(driver):
+    try:
+        driver.execute_cdp_cmd("Performance.enable", {})
+        metrics = driver.execute_cdp_cmd("Performance.getMetrics", {}).get("metrics", [])
+        heap = next((metric["value"] for metric in metrics if metric["name"] == "JSHeapTotalSize"), None)
+        return heap / (1024 * 1024) if heap is not None else None
+    except Exception:
+        return None
+
+visited_origins = {}
+visited_origins_lock = threading.Lock()
+
+def url_origin(url):
+    if "//" not in url or url.startswith(("about:", "data:", "chrome:")):
+        return None
+    return "/".join(url.split("/")[:3])
+
+def remember_tab_origins(driver):
+    try:
+        urls = [entry.get("url", "") for entry in driver.execute_cdp_cmd("Page.getNavigationHistory", {}).get("entries", [])]
+    except Exception:
+        urls = []
+    urls.append(driver.current_url)
+    with visited_origins_lock:
+        origins = visited_origins.setdefault(id(driver), set())
+        origins.update(origin for origin in map(url_origin, urls) if origin)
+
+def forget_origins(driver):
+    with visited_origins_lock:
+        return visited_origins.pop(id(driver), set())
+
+def clear_browser_state(driver):
+    remember_tab_origins(driver)
+    for origin in forget_origins(driver):
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+
+def reset_browser(driver):
+    handles = driver.window_handles
+    for handle in reversed(handles):
+        driver.switch_to.window(handle)
+        remember_tab_origins(driver)
+        if handle != handles[0]:
+            driver.close()
+    driver.switch_to.window(handles[0])
+    clear_browser_state(driver)
+    driver.get("about:blank")
+    if FAST_LOAD:
+        driver.get_log("performance")
+
+session_ids = itertools.count(1)
+
+class AgentSession:
+    def __init__(self, driver):
+        self.id = next(session_ids)
+        self.driver = driver
+        self.lock = threading.Lock()
+        self.conversation_history = []
+        self.last_found_element = None
+        self.last_action_error = None
+        self.element_handles = {}
+        self.locator_stats = {}
+        self.dom_snapshot = {"id": 0, "url": None, "window": None, "elements": None, "latest": None, "deltas": 0}
+        self.network_savings = {"blocked_requests": 0, "loaded_requests": 0, "transferred_bytes": 0}
+        self.history_digest = []
+        self.wait_stats = {}
+        self.trace = []
+        self.response_stats = {"retries": 0, "validation_failures": 0, "extraction_seconds": 0.0}
+        self.prefetch_stats = {"started": 0, "used": 0, "discarded": 0, "overlap_seconds": 0.0}
+        self.fast_path_stats = {"tasks": 0, "answered": 0, "escalated": 0, "skipped": 0, "pages": 0, "bytes": 0}
+        self.task_number = 0
+        self.iteration = 0
+        self.last_screenshot = 0.0
+        self.listener = None
+        self.trace_origin = time.perf_counter()
+        self.token_usage = {"requests": 0, "input_tokens": 0, "reported_input_tokens": 0, "cached_input_tokens": 0, "last_request": None}
+
+session_context = threading.local()
+
+browser_pool = BrowserPool(1)
+default_session = None
+default_session_lock = threading.Lock()
+
+def current_session():
+    global default_session
+    session = getattr(session_context, "session", None)
+    if session is not None:
+        return session
+    with default_session_lock:
+        if default_session is None:
+            default_session = AgentSession(browser_pool.acquire())
+    return default_session
+
+def active_session():
+    return getattr(session_context, "session", None) or default_session
+
+def activate_session(session):
+    session_context.session = session
+
+class InMemoryMetrics:
+    def __init__(self, histogram_size=1000):
+        self.histogram_size = histogram_size
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def series(name, tags):
+        if not tags:
+            return name
+        return name + "{" + ",".join(f"{key}={value}" for key, value in sorted(tags.items())) + "}"
+
+    def increment(self, name, value=1, tags=None):
+        key = self.series(name, tags)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, tags=None):
+        key = self.series(name, tags)
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {"count": 0, "sum": 0.0, "min": value, "max": value, "recent": []})
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["min"] = min(histogram["min"], value)
+            histogram["max"] = max(histogram["max"], value)
+            histogram["recent"].append(value)
+            del histogram["recent"][:-self.histogram_size]
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {}
+            for key, histogram in self.histograms.items():
+                recent = sorted(histogram["recent"])
+                histograms[key] = {
+                    "count": histogram["count"],
+                    "sum": histogram["sum"],
+                    "min": histogram["min"],
+                    "max": histogram["max"],
+                    "p50": recent[len(recent) // 2],
+                    "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                }
+            return {"counters": dict(self.counters), "histograms": histograms}
+
+metrics_sink = InMemoryMetrics(METRICS_HISTOGRAM_SIZE)
+
+def set_metrics_sink(sink):
+    global metrics_sink
+    metrics_sink = sink
+
+def record_span(name, start, duration, tags=None):
+    session = current_session()
+    if TRACE_ENABLED and len(session.trace) < TRACE_MAX_EVENTS:
+        session.trace.append({
+            "name": name,
+            "start": start - session.trace_origin,
+            "duration": duration,
+            "thread": threading.current_thread().name,
+            "tags": dict(tags or {}),
+        })
+    metrics_sink.observe(f"{name}_seconds", duration, tags)
+    if session.listener is not None:
+        session.listener(name, duration, tags)
+
+@contextlib.contextmanager
+def span(name, **tags):
+    start = time.perf_counter()
+    try:
+        yield tags
+    finally:
+        record_span(name, start, time.perf_counter() - start, tags)
+
+def summarize_trace(trace):
+    summary = {}
+    for event in trace:
+        phase = summary.setdefault(event["name"], {"count": 0, "seconds": 0.0})
+        phase["count"] += 1
+        phase["seconds"] += event["duration"]
+    return summary
+
+def chrome_trace_events(trace, session_id):
+    return [
+        {
+            "name": event["name"],
+            "cat": "wepilot",
+            "ph": "X",
+            "ts": round(event["start"] * 1e6),
+            "dur": round(event["duration"] * 1e6),
+            "pid": os.getpid(),
+            "tid": session_id,
+            "args": {**event["tags"], "thread": event["thread"]},
+        }
+        for event in trace
     ]
-    
-    for pattern in search_patterns:
-        key, value = next(iter(pattern.items()))
-        if callable(value):
-            found = soup.find_all(lambda tag: tag.name in ['input', 'textarea'] and value(tag.get(key, '')))
+
+def export_trace(path, trace=None, format="json"):
+    session = current_session()
+    trace = session.trace if trace is None else trace
+    if format == "chrome":
+        payload = {"traceEvents": chrome_trace_events(trace, session.id), "displayTimeUnit": "ms"}
+    else:
+        payload = {"session": session.id, "events": trace, "summary": summarize_trace(trace)}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    return path
+
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'svg'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+SEARCH_INPUT_TAGS = {'input', 'textarea'}
+INTERACTIVE_TAGS = {'a', 'button', 'input', 'textarea', 'select'}
+CLICKABLE_ROLES = {'button', 'link', 'tab'}
+CLICKABLE_CLASSES = {'btn', 'button', 'clickable', 'link', 'submit', 'nav-item'}
+MAX_TRACKED_DEPTH = 256
+HANDLE_FALLBACK_KEYS = ('tag', 'id', 'name', 'type', 'placeholder', 'aria-label', 'role', 'href')
+TEXT_CAPTURE_LIMIT = 200
+
+def is_search_input(tag, attrs):
+    if tag not in SEARCH_INPUT_TAGS:
+        return False
+    if attrs.get('type') == 'search' or attrs.get('name') == 'q':
+        return True
+    for key in ('placeholder', 'aria-label'):
+        if 'search' in (attrs.get(key) or '').lower():
+            return True
+    for key in ('class', 'id'):
+        value = (attrs.get(key) or '').lower()
+        if 'search' in value or 'query' in value:
+            return True
+    return False
+
+def is_clickable(tag, attrs):
+    if tag in INTERACTIVE_TAGS:
+        return True
+    if 'onclick' in attrs and attrs.get('role') in CLICKABLE_ROLES:
+        return True
+    return any(cls in CLICKABLE_CLASSES for cls in (attrs.get('class') or '').split())
+
+def describe_element(tag, attrs, text, is_search, location):
+    attributes = {
+        'handle': attrs.get(HANDLE_ATTRIBUTE),
+        'tag': tag,
+        'id': attrs.get('id'),
+        'class': ' '.join(attrs['class'].split()) if attrs.get('class') is not None else None,
+        'name': attrs.get('name'),
+        'type': attrs.get('type'),
+        'placeholder': attrs.get('placeholder'),
+        'aria-label': attrs.get('aria-label'),
+        'role': attrs.get('role'),
+        'text': text[:100] if text else None,
+    }
+    if is_search:
+        attributes['is_search'] = True
+        attributes['is_visible'] = is_likely_visible(attrs)
+    else:
+        attributes['href'] = attrs.get('href')
+        attributes['onclick'] = attrs.get('onclick')
+        attributes['is_visible'] = True
+    attributes['location'] = location
+    return {k: v for k, v in attributes.items() if v is not None}
+
+class ElementCollector:
+    def __init__(self, max_chars=5000):
+        self.max_chars = max_chars
+        self.stack = [('[document]', {})]
+        self.overflow_depth = 0
+        self.skip_depth = 0
+        self.open_records = []
+        self.search_records = []
+        self.clickable_records = []
+        self.seen = set()
+        self.char_count = 0
+        self.clickables_full = False
+        self.done = False
+
+    def start(self, tag, attrib):
+        if self.done:
+            return
+        tag = tag.lower()
+        if self.skip_depth:
+            if tag in SKIPPED_TAGS:
+                self.skip_depth += 1
+            return
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = 1
+            return
+        attrs = {key.lower(): '' if value is None else value for key, value in dict(attrib).items()}
+
+        is_search = is_search_input(tag, attrs)
+        if is_search or (not self.clickables_full and is_clickable(tag, attrs) and is_likely_visible(attrs)):
+            record = {
+                'tag': tag,
+                'attrs': attrs,
+                'is_search': is_search,
+                'location': get_element_location(self.stack),
+                'text': [],
+                'text_length': 0,
+                'element': None,
+            }
+            (self.search_records if is_search else self.clickable_records).append(record)
+            if tag in VOID_TAGS:
+                self._finish_record(record)
+            else:
+                self.open_records.append((len(self.stack), record))
+
+        if tag in VOID_TAGS:
+            return
+        if len(self.stack) >= MAX_TRACKED_DEPTH:
+            self.overflow_depth += 1
         else:
-            found = soup.find_all(['input', 'textarea'], {key: value})
-        search_inputs.extend(found)
-    
-    interactive_tags = ['a', 'button', 'input', 'textarea', 'select']
-    clickable_elements = soup.find_all(interactive_tags)
-    
-    clickable_elements.extend(soup.find_all(attrs={'onclick': True, 'role': ['button', 'link', 'tab']}))
-    
-    clickable_classes = ['btn', 'button', 'clickable', 'link', 'submit', 'nav-item']
-    for cls in clickable_classes:
-        clickable_elements.extend(soup.find_all(attrs={'class': lambda x: x and cls in x.split()}))
-    
-    processed_html = []
-    
-    for element in search_inputs:
-        attributes = {
-            'tag': element.name,
-            'id': element.get('id'),
-            'class': ' '.join(element.get('class', [])) if isinstance(element.get('class'), list) else element.get('class'),
-            'name': element.get('name'),
-            'type': element.get('type'),
-            'placeholder': element.get('placeholder'),
-            'aria-label': element.get('aria-label'),
-            'role': element.get('role'),
-            'text': element.get_text().strip()[:100] if element.get_text().strip() else None,
-            'is_search': True,
-            'is_visible': is_likely_visible(element),
-            'location': get_element_location(element)
-        }
-        attributes = {k: v for k, v in attributes.items() if v is not None}
-        
-        if attributes:
-            processed_html.append(str(attributes))
-    
-    for element in clickable_elements:
-        if element in search_inputs:
-            continue
-            
-        if not is_likely_visible(element):
-            continue
-            
-        attributes = {
-            'tag': element.name,
-            'id': element.get('id'),
-            'class': ' '.join(element.get('class', [])) if isinstance(element.get('class'), list) else element.get('class'),
-            'name': element.get('name'),
-            'type': element.get('type'),
-            'placeholder': element.get('placeholder'),
-            'aria-label': element.get('aria-label'),
-            'role': element.get('role'),
-            'text': element.get_text().strip()[:100] if element.get_text().strip() else None,
-            'href': element.get('href'),
-            'onclick': element.get('onclick'),
-            'is_visible': True,
-            'location': get_element_location(element)
-        }
-        attributes = {k: v for k, v in attributes.items() if v is not None}
-        
-        if attributes:
-            processed_html.append(str(attributes))
-    
-    return '\n'.join(processed_html)[:max_chars]
+            self.stack.append((tag, attrs))
+
+    def end(self, tag):
+        if self.done:
+            return
+        tag = tag.lower()
+        if self.skip_depth:
+            if tag in SKIPPED_TAGS:
+                self.skip_depth -= 1
+            return
+        if tag in VOID_TAGS:
+            return
+        if self.overflow_depth:
+            self.overflow_depth -= 1
+            return
+        for index in range(len(self.stack) - 1, 0, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+        while self.open_records and self.open_records[-1][0] >= len(self.stack):
+            self._finish_record(self.open_records.pop()[1])
+
+    def data(self, text):
+        if self.done or self.skip_depth or not self.open_records:
+            return
+        for _, record in self.open_records:
+            if record['text_length'] >= TEXT_CAPTURE_LIMIT:
+                continue
+            chunk = text if record['text'] else text.lstrip()
+            if chunk:
+                chunk = chunk[:TEXT_CAPTURE_LIMIT - record['text_length']]
+                record['text'].append(chunk)
+                record['text_length'] += len(chunk)
+
+    def close(self):
+        while self.open_records:
+            self._finish_record(self.open_records.pop()[1])
+        self.done = True
+        elements = []
+        for record in self.search_records + self.clickable_records:
+            if record['element'] is not None:
+                elements.append(record['element'])
+        return elements
+
+    def _finish_record(self, record):
+        attributes = describe_element(
+            record['tag'], record['attrs'], ''.join(record['text']).strip(),
+            record['is_search'], record['location'],
+        )
+        rendered = str(attributes)
+        record['attrs'] = record['text'] = None
+        if rendered in self.seen:
+            return
+        self.seen.add(rendered)
+        record['element'] = attributes
+        self.char_count += len(rendered) + 1
+        if self.char_count > self.max_chars:
+            self.clickables_full = True
+
+class StreamingHTMLParser(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag, attrs)
+        if tag.lower() not in VOID_TAGS:
+            self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+def collect_interactive_elements(html, max_chars=5000, backend=None):
+    backend = backend or HTML_PARSER_BACKEND
+    collector = ElementCollector(max_chars)
+
+    if backend == "lxml" and lxml_etree is not None:
+        parser = lxml_etree.HTMLParser(target=collector)
+        feed = parser.feed
+    else:
+        parser = StreamingHTMLParser(collector)
+        feed = parser.feed
+
+    for offset in range(0, len(html), HTML_FEED_CHUNK_SIZE):
+        feed(html[offset:offset + HTML_FEED_CHUNK_SIZE])
+
+    return collector.close()
+
+def format_elements(elements, max_chars=5000):
+    return '\n'.join(str(element) for element in elements)[:max_chars]
+
+def preprocess_html(html, max_chars=5000):
+    return format_elements(collect_interactive_elements(html, max_chars), max_chars)
 
 def is_likely_visible(element):
     if element.get('hidden') or element.get('style') and ('display:none' in element['style'] or 'visibility:hidden' in element['style']):
@@ -140,27 +771,638 @@ def is_likely_visible(element):
     
     return True
 
-def get_element_location(element):
+def get_element_location(ancestors):
     parent_tags = []
-    parent = element.parent
-    
-    for _ in range(3):
-        if parent and parent.name:
-            parent_tags.append(parent.name)
-            if parent.get('id'):
-                parent_tags[-1] += f"#{parent.get('id')}"
-            elif parent.get('class'):
-                classes = parent.get('class')
-                if isinstance(classes, list):
-                    parent_tags[-1] += f".{'.'.join(classes)}"
-                else:
-                    parent_tags[-1] += f".{classes}"
-            parent = parent.parent
-        else:
-            break
+    
+    for name, attrs in reversed(ancestors[-3:]):
+        parent_tags.append(name)
+        if attrs.get('id'):
+            parent_tags[-1] += f"#{attrs.get('id')}"
+        elif attrs.get('class'):
+            parent_tags[-1] += f".{'.'.join(attrs.get('class').split())}"
     
     return ' > '.join(reversed(parent_tags)) if parent_tags else None
 
+EXTRACT_ELEMENTS_JS = """
+var maxChars = arguments[0];
+var handleAttribute = arguments[1];
+var clickableRoles = ['button', 'link', 'tab'];
+var clickableClasses = ['btn', 'button', 'clickable', 'link', 'submit', 'nav-item'];
+var invisibleClasses = ['hidden', 'invisible', 'collapsed', 'sr-only', 'visually-hidden'];
+
+function attr(el, name) {
+    return el.getAttribute(name);
+}
+
+function isSearchInput(el) {
+    var type = attr(el, 'type');
+    var name = attr(el, 'name');
+    var placeholder = (attr(el, 'placeholder') || '').toLowerCase();
+    var aria = (attr(el, 'aria-label') || '').toLowerCase();
+    var cls = (attr(el, 'class') || '').toLowerCase();
+    var id = (attr(el, 'id') || '').toLowerCase();
+    return type === 'search' || name === 'q' ||
+        placeholder.indexOf('search') !== -1 || aria.indexOf('search') !== -1 ||
+        cls.indexOf('search') !== -1 || cls.indexOf('query') !== -1 ||
+        id.indexOf('search') !== -1 || id.indexOf('query') !== -1;
+}
+
+function isVisible(el) {
+    var rect = el.getBoundingClientRect();
+    if (rect.width <= 0 || rect.height <= 0) {
+        return false;
+    }
+    var style = window.getComputedStyle(el);
+    return style.display !== 'none' && style.visibility !== 'hidden' &&
+        style.visibility !== 'collapse' && parseFloat(style.opacity) !== 0;
+}
+
+function describeLocation(el) {
+    var parts = [];
+    var parent = el.parentElement;
+    for (var i = 0; i < 3 && parent; i++) {
+        var part = parent.tagName.toLowerCase();
+        var cls = (attr(parent, 'class') || '').trim();
+        if (attr(parent, 'id')) {
+            part += '#' + attr(parent, 'id');
+        } else if (cls) {
+            part += '.' + cls.split(/\\s+/).join('.');
+        }
+        parts.unshift(part);
+        parent = parent.parentElement;
+    }
+    return parts.length ? parts.join(' > ') : null;
+}
+
+function assignHandle(el, name) {
+    if (!el.hasAttribute(name)) {
+        window.__wpPage = window.__wpPage || Math.random().toString(36).slice(2, 4);
+        window.__wpNextHandle = (window.__wpNextHandle || 0) + 1;
+        el.setAttribute(name, window.__wpPage + window.__wpNextHandle);
+    }
+    return el.getAttribute(name);
+}
+
+function describe(el, isSearch) {
+    var cls = attr(el, 'class');
+    var text = (el.textContent || '').trim();
+    var entry = {
+        'handle': handleAttribute ? assignHandle(el, handleAttribute) : null,
+        'tag': el.tagName.toLowerCase(),
+        'id': attr(el, 'id'),
+        'class': cls === null ? null : cls.trim().split(/\\s+/).join(' '),
+        'name': attr(el, 'name'),
+        'type': attr(el, 'type'),
+        'placeholder': attr(el, 'placeholder'),
+        'aria-label': attr(el, 'aria-label'),
+        'role': attr(el, 'role'),
+        'text': text ? text.substring(0, 100) : null
+    };
+    if (isSearch) {
+        entry['is_search'] = true;
+    } else {
+        entry['href'] = attr(el, 'href');
+        entry['onclick'] = attr(el, 'onclick');
+    }
+    entry['is_visible'] = true;
+    entry['location'] = describeLocation(el);
+    var compact = {};
+    for (var key in entry) {
+        if (entry[key] !== null) {
+            compact[key] = entry[key];
+        }
+    }
+    return compact;
+}
+
+var results = [];
+var seen = new Set();
+var used = 0;
+
+function add(el, isSearch) {
+    if (used > maxChars || seen.has(el) || el.closest('svg') || !isVisible(el)) {
+        return;
+    }
+    seen.add(el);
+    var entry = describe(el, isSearch);
+    used += JSON.stringify(entry).length + 1;
+    results.push(entry);
+}
+
+var inputs = document.querySelectorAll('input, textarea');
+for (var i = 0; i < inputs.length && used <= maxChars; i++) {
+    if (isSearchInput(inputs[i])) {
+        add(inputs[i], true);
+    }
+}
+
+var candidates = document.querySelectorAll(
+    'a, button, input, textarea, select, [onclick][role], ' +
+    clickableClasses.map(function (cls) { return '.' + cls; }).join(', ')
+);
+for (var j = 0; j < candidates.length && used <= maxChars; j++) {
+    var el = candidates[j];
+    if (el.hasAttribute('onclick') && !/^(a|button|input|textarea|select)$/i.test(el.tagName) &&
+            clickableRoles.indexOf(attr(el, 'role')) === -1 &&
+            !clickableClasses.some(function (cls) { return el.classList.contains(cls); })) {
+        continue;
+    }
+    var classes = (attr(el, 'class') || '').split(/\\s+/);
+    if (invisibleClasses.some(function (cls) { return classes.some(function (c) { return c.indexOf(cls) !== -1; }); })) {
+        continue;
+    }
+    add(el, false);
+}
+
+return JSON.stringify(results);
+"""
+
+def collect_elements_in_browser(max_chars=5000):
+    driver = current_session().driver
+    payload = driver.execute_script(EXTRACT_ELEMENTS_JS, max_chars, HANDLE_ATTRIBUTE if ELEMENT_HANDLES else None)
+    return json.loads(payload or '[]')
+
+TAG_ELEMENTS_JS = """
+var name = arguments[0];
+var elements = document.querySelectorAll(
+    'a, button, input, textarea, select, [onclick][role], .btn, .button, .clickable, .link, .submit, .nav-item'
+);
+window.__wpPage = window.__wpPage || Math.random().toString(36).slice(2, 4);
+var next = window.__wpNextHandle || 0;
+for (var i = 0; i < elements.length; i++) {
+    if (!elements[i].hasAttribute(name)) {
+        next += 1;
+        elements[i].setAttribute(name, window.__wpPage + next);
+    }
+}
+window.__wpNextHandle = next;
+"""
+
+def register_handles(elements):
+    element_handles = current_session().element_handles
+    for element in elements:
+        handle = element.get('handle')
+        if handle:
+            element_handles.pop(handle, None)
+            element_handles[handle] = {k: v for k, v in element.items() if k in HANDLE_FALLBACK_KEYS}
+    while len(element_handles) > MAX_REGISTERED_HANDLES:
+        element_handles.pop(next(iter(element_handles)))
+
+def extract_element_list(max_chars=5000):
+    session = current_session()
+    driver = session.driver
+    elements = None
+    if ELEMENT_EXTRACTOR == "browser":
+        try:
+            with span("browser_extract"):
+                elements = collect_elements_in_browser(max_chars)
+        except Exception as e:
+            print(f"In-browser extraction failed: {str(e)}, falling back to page source")
+    if elements is None:
+        if ELEMENT_HANDLES:
+            try:
+                driver.execute_script(TAG_ELEMENTS_JS, HANDLE_ATTRIBUTE)
+            except Exception as e:
+                print(f"Could not assign element handles: {str(e)}")
+        with span("page_source"):
+            html = driver.page_source
+        with span("parse_elements"):
+            elements = collect_interactive_elements(html, max_chars)
+    register_handles(elements)
+    return elements
+
+RANKING_FIELDS = ('text', 'aria-label', 'placeholder', 'href', 'name', 'id')
+ROW_FIELDS = ('handle', 'tag', 'text', 'aria-label', 'placeholder', 'name', 'id', 'type', 'role', 'href', 'class', 'location')
+RANKING_STOPWORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'from', 'in', 'into', 'is', 'it', 'of', 'on', 'or', 'the', 'then', 'to', 'with'}
+
+ELEMENT_ROW_LEGEND = """
+The HTML Elements list has one element per line, most relevant first, with '|' separated columns:
+handle|tag|text|aria-label|placeholder|name|id|type|role|href|class|location|flags
+Empty columns are left blank and trailing empty columns are dropped. A "search" flag marks search inputs.
+Copy the non-empty columns you need into element_properties using the column names above.
+"""
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def ranking_terms(text):
+    return [term for term in re.findall(r"[a-z0-9]+", text.lower()) if term not in RANKING_STOPWORDS]
+
+def rank_elements(elements, query, k1=1.2, b=0.75):
+    documents = [ranking_terms(' '.join(str(element.get(field, '')) for field in RANKING_FIELDS)) for element in elements]
+    query_terms = set(ranking_terms(query or ''))
+    average_length = sum(len(document) for document in documents) / len(documents) if documents else 0
+    document_frequency = {}
+    for document in documents:
+        for term in set(document) & query_terms:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    scored = []
+    for index, (element, document) in enumerate(zip(elements, documents)):
+        score = 0.0
+        for term in query_terms:
+            frequency = document.count(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(document) / (average_length or 1)))
+        if element.get('is_search'):
+            score += 0.5
+        scored.append((-score, index, element))
+    return [element for _, _, element in sorted(scored, key=lambda item: item[:2])]
+
+def encode_element_row(element):
+    values = []
+    for field in ROW_FIELDS:
+        value = element.get(field)
+        if value is None:
+            value = ''
+        elif field == 'class':
+            value = ' '.join(str(value).split()[:3])
+        elif field == 'href':
+            value = re.sub(r"^https?://", "", str(value))[:80]
+        elif field in ('text', 'location'):
+            value = str(value)[:80]
+        values.append(' '.join(str(value).replace('|', '/').split()))
+    if element.get('is_search'):
+        values.append('search')
+    return '|'.join(values).rstrip('|')
+
+def select_elements(elements, query=None):
+    if ELEMENT_ENCODING != "ranked":
+        return elements
+    selected = []
+    used = 0
+    for element in rank_elements(elements, query):
+        cost = estimate_tokens(encode_element_row(element)) + 1
+        if used + cost > ELEMENT_TOKEN_BUDGET:
+            continue
+        selected.append(element)
+        used += cost
+    print(f"Element list: {len(selected)} of {len(elements)} elements, ~{used} tokens")
+    return selected
+
+def render_elements(elements, max_chars=5000):
+    if ELEMENT_ENCODING == "ranked":
+        return '\n'.join(encode_element_row(element) for element in elements)
+    return format_elements(elements, max_chars)
+
+def candidate_chars(max_chars):
+    return max(max_chars, ELEMENT_CANDIDATE_CHARS) if ELEMENT_ENCODING == "ranked" else max_chars
+
+def extract_page_elements(max_chars=5000, query=None):
+    elements = select_elements(extract_element_list(candidate_chars(max_chars)), query)
+    return render_elements(elements, max_chars)
+
+TRACK_MUTATIONS_JS = """
+var installed = !!window.__wpObserver;
+var count = installed ? window.__wpMutations : -1;
+if (!installed && document.documentElement) {
+    window.__wpObserver = new MutationObserver(function (records) {
+        window.__wpMutations += records.length;
+    });
+    window.__wpObserver.observe(document.documentElement, {
+        childList: true,
+        subtree: true,
+        characterData: true,
+        attributes: true,
+        attributeFilter: ['class', 'style', 'hidden', 'disabled', 'href', 'role', 'aria-label', 'aria-hidden', 'aria-expanded', 'placeholder', 'value', 'open']
+    });
+}
+window.__wpMutations = 0;
+return count;
+"""
+
+def element_key(element):
+    if element.get('handle'):
+        return ('handle', element['handle'])
+    return tuple(element.get(key) for key in ('tag', 'id', 'name', 'type', 'href', 'aria-label', 'placeholder', 'location'))
+
+def keyed_elements(elements):
+    keyed = {}
+    occurrences = {}
+    for element in elements:
+        key = element_key(element)
+        occurrences[key] = occurrences.get(key, 0) + 1
+        keyed[(key, occurrences[key])] = element
+    return keyed
+
+def diff_elements(baseline, current):
+    before = keyed_elements(baseline)
+    after = keyed_elements(current)
+    added = [element for key, element in after.items() if key not in before]
+    removed = [element for key, element in before.items() if key not in after]
+    changed = [element for key, element in after.items() if key in before and before[key] != element]
+    return added, removed, changed
+
+def reset_dom_snapshot():
+    current_session().dom_snapshot.update({"url": None, "window": None, "elements": None, "latest": None, "deltas": 0})
+
+def render_delta(baseline, elements, max_chars=5000):
+    added, removed, changed = diff_elements(baseline, elements)
+    sections = []
+    for label, group in (("Added", added), ("Removed", removed), ("Changed", changed)):
+        if group:
+            sections.append(f"{label}:\n" + render_elements(group, max_chars))
+    return '\n'.join(sections) or "No interactive elements changed.", (len(added), len(removed), len(changed))
+
+def extract_page_snapshot(max_chars=5000, query=None):
+    if not INCREMENTAL_SNAPSHOTS:
+        return extract_page_elements(max_chars, query)
+
+    driver = current_session().driver
+    dom_snapshot = current_session().dom_snapshot
+    try:
+        mutations = driver.execute_script(TRACK_MUTATIONS_JS)
+        url = driver.current_url
+        window = driver.current_window_handle
+    except Exception:
+        mutations, url, window = -1, None, None
+
+    has_baseline = (
+        dom_snapshot["elements"] is not None and mutations is not None and mutations >= 0 and
+        url == dom_snapshot["url"] and window == dom_snapshot["window"] and
+        dom_snapshot["deltas"] < DELTA_MAX_CHAIN
+    )
+
+    if has_baseline and mutations == 0:
+        dom_snapshot["deltas"] += 1
+        if dom_snapshot["latest"] is None:
+            return f"No changes since snapshot #{dom_snapshot['id']}; its elements are still current."
+        delta, _ = render_delta(dom_snapshot["elements"], dom_snapshot["latest"], max_chars)
+        return f"No changes since the previous update. Cumulative delta against snapshot #{dom_snapshot['id']} (elements not listed are unchanged):\n{delta}"
+
+    elements = select_elements(extract_element_list(candidate_chars(max_chars)), query)
+    full_snapshot = render_elements(elements, max_chars)
+
+    if has_baseline:
+        delta, (added, removed, changed) = render_delta(dom_snapshot["elements"], elements, max_chars)
+        if len(delta) <= len(full_snapshot) * DELTA_MAX_RATIO:
+            dom_snapshot["deltas"] += 1
+            dom_snapshot["latest"] = elements
+            print(f"Sending DOM delta against snapshot #{dom_snapshot['id']}: {added} added, {removed} removed, {changed} changed")
+            return f"Delta against snapshot #{dom_snapshot['id']} (elements not listed are unchanged):\n{delta}"
+
+    dom_snapshot.update({"id": dom_snapshot["id"] + 1, "url": url, "window": window, "elements": elements, "latest": None, "deltas": 0})
+    return f"Snapshot #{dom_snapshot['id']} (full):\n{full_snapshot}"
+
+class ResponseCache:
+    def __init__(self, max_entries=256, path=None, ttl=24 * 3600, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[1] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+            self.entries.pop(key, None)
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT response, created FROM responses WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self.db.commit()
+                    self._remember(key, row[0], row[1])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock:
+            self._remember(key, response, now)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self.db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+                    (self.max_disk_entries,)
+                )
+                self.db.commit()
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+
+    def _remember(self, key, response, created):
+        self.entries[key] = (response, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+llm_cache = ResponseCache(LLM_CACHE_SIZE, LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_DISK_ENTRIES)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class LLMEndpoint:
+    def __init__(self, client, name, rate=None, burst=None):
+        self.client = client
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.latencies = []
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+
+    def call(self, kwargs):
+        start = time.monotonic()
+        try:
+            result = self.client.chat.completions.create(**kwargs)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+                self.cooldown_until = time.monotonic() + min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** self.failures)
+            raise
+        with self.lock:
+            self.failures = 0
+            if not kwargs.get("stream"):
+                self.latencies.append(time.monotonic() - start)
+                del self.latencies[:-200]
+        return result
+
+    def latency_quantile(self, quantile):
+        with self.lock:
+            if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * quantile))]
+
+class LLMCompletions:
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def create(self, **kwargs):
+        return self.gateway.create(**kwargs)
+
+class LLMChat:
+    def __init__(self, gateway):
+        self.completions = LLMCompletions(gateway)
+
+class LLMGateway:
+    def __init__(self, endpoints, rate=None, burst=None, max_attempts=3, hedge=True, max_in_flight=None):
+        self.endpoints = [
+            endpoint if isinstance(endpoint, LLMEndpoint) else LLMEndpoint(endpoint, f"endpoint-{index}", rate, burst)
+            for index, endpoint in enumerate(endpoints)
+        ]
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.next_index = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight or LLM_MAX_IN_FLIGHT, thread_name_prefix="wepilot-llm")
+        self.stats = {"requests": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "rate_limited_seconds": 0.0}
+        self.lock = threading.Lock()
+        self.chat = LLMChat(self)
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+        metrics_sink.increment(f"llm_gateway_{name}", value)
+
+    def _pick(self, exclude=None):
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if endpoint is not exclude] or self.endpoints
+        ready = [endpoint for endpoint in candidates if endpoint.cooldown_until <= now] or candidates
+        return ready[next(self.next_index) % len(ready)]
+
+    def _submit(self, endpoint, kwargs):
+        if endpoint.bucket:
+            waited = endpoint.bucket.acquire()
+            if waited:
+                self._count("rate_limited_seconds", waited)
+        started = threading.Event()
+
+        def call():
+            started.set()
+            return endpoint.call(kwargs)
+
+        return self.executor.submit(call), started
+
+    def _hedged_call(self, primary, kwargs):
+        future, started = self._submit(primary, kwargs)
+        futures = {future: primary}
+        delay = primary.latency_quantile(LLM_HEDGE_QUANTILE) if self.hedge and not kwargs.get("stream") else None
+        if delay is not None:
+            started.wait()
+            done, _ = wait_futures(futures, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                backup = self._pick(exclude=primary)
+                if backup.bucket is None or backup.bucket.try_acquire():
+                    self._count("hedged")
+                    futures[self.executor.submit(backup.call, kwargs)] = backup
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if futures[future] is not primary:
+                    self._count("hedge_wins")
+                return result
+        raise error
+
+    def create(self, **kwargs):
+        self._count("requests")
+        for attempt in range(self.max_attempts):
+            endpoint = self._pick()
+            try:
+                return self._hedged_call(endpoint, kwargs)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_attempts - 1:
+                    raise
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+                print(f"LLM request to {endpoint.name} failed ({str(e)[:80]}), retrying in {delay:.2f}s")
+                self._count("retries")
+                time.sleep(delay)
+
+RETRYABLE_STATUS_CODES = (408, 409, 425, 429)
+TRANSPORT_ERROR_NAMES = {"ConnectionError", "Timeout", "TimeoutException", "TransportError", "ChunkedEncodingError"}
+
+def is_retryable_error(error):
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, http.client.HTTPException)):
+        return True
+    return any(cls.__name__ in TRANSPORT_ERROR_NAMES for cls in type(error).__mro__)
+
+def build_llm_client(endpoints=None):
+    clients = []
+    for index, endpoint in enumerate(endpoints or LLM_ENDPOINTS):
+        endpoint = dict(endpoint)
+        name = endpoint.pop("name", None) or f"{endpoint.get('provider', 'hf')}:{endpoint.get('model', index)}"
+        rate = endpoint.pop("rate", LLM_RATE_LIMIT)
+        burst = endpoint.pop("burst", LLM_RATE_BURST)
+        clients.append(LLMEndpoint(InferenceClient(**endpoint), name, rate, burst))
+    return LLMGateway(clients, max_attempts=LLM_MAX_ATTEMPTS, hedge=LLM_HEDGE_ENABLED)
+
+client = build_llm_client()
+
+def llm_cache_key(command, browser_state):
+    normalized_command = ' '.join(command.lower().split())
+    return hashlib.sha256(json.dumps([normalized_command, browser_state]).encode('utf-8')).hexdigest()
+
 few_shot_examples = """
 Example 1:
 Command: "Search for cat videos on YouTube"
@@ -194,28 +1436,211 @@ Actions: [
 ]
 """
 
-def send_command_to_llm(command, html=None):
-    global conversation_history
-    
-    system_message = {
-        "role": "system", 
-        "content": """You are a web automation agent. You understand user commands and can perform actions like navigating websites, finding elements dynamically, clicking, typing, etc.
+ACTION_TYPES = (
+    "navigate", "find_and_click", "type", "press_enter", "scroll", "scroll_to_element", "new_tab",
+    "close_tab", "switch_tab", "refresh_page", "go_back", "go_forward", "wait", "complete"
+)
+ACTION_FIELD_TYPES = {
+    "description": str,
+    "url": str,
+    "text": str,
+    "use_previous_element": bool,
+    "direction": str,
+    "amount": (int, float),
+    "alignment": str,
+    "index": int,
+    "seconds": (int, float),
+    "element_properties": dict,
+}
+ACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "actions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "enum": list(ACTION_TYPES)},
+                    "description": {"type": "string"},
+                    "url": {"type": "string"},
+                    "text": {"type": "string"},
+                    "use_previous_element": {"type": "boolean"},
+                    "direction": {"type": "string", "enum": ["up", "down", "to_top", "to_bottom"]},
+                    "amount": {"type": "number"},
+                    "alignment": {"type": "string"},
+                    "index": {"type": "integer"},
+                    "seconds": {"type": "number"},
+                    "element_properties": {"type": "object", "additionalProperties": {"type": ["string", "boolean"]}},
+                },
+                "required": ["action"],
+            },
+        },
+    },
+    "required": ["actions"],
+}
+structured_output_supported = True
 
-Your primary task is to generate actions to complete web tasks. Instead of using fixed CSS selectors, you should identify elements based on their attributes like text content, aria-labels, placeholders, or other identifying features.
+def structured_output_options():
+    if not (STRUCTURED_OUTPUT and structured_output_supported):
+        return {}
+    return {"response_format": {"type": "json_schema", "json_schema": {"name": "browser_actions", "schema": ACTION_SCHEMA}}}
 
-IMPORTANT: Always provide your responses in valid JSON format. Do not include any explanations, markdown formatting, or narrative text outside the JSON.
+def disable_structured_output(error):
+    global structured_output_supported
+    if structured_output_supported and re.search(r"response_format|json_schema|schema", str(error), re.IGNORECASE):
+        structured_output_supported = False
+        print("Provider rejected schema-constrained output, continuing without it")
+        return True
+    return False
 
-CRITICAL: Be aware of the current state of the browser. If you are already on a website, do not navigate to it again. Continue from the current page state.
+def validate_action(action):
+    if not isinstance(action, dict):
+        return f"action is not an object: {str(action)[:60]}"
+    if action.get("action") not in ACTION_TYPES:
+        return f"unknown action: {action.get('action')}"
+    for field, expected in ACTION_FIELD_TYPES.items():
+        if field in action and action[field] is not None and not isinstance(action[field], expected):
+            return f"{action['action']}.{field} has the wrong type"
+    if action["action"] == "navigate" and not action.get("url"):
+        return "navigate without url"
+    return None
 
-Available actions:
-- "navigate": Go to a specific URL (only use if not already on the site)
-- "find_and_click": Find an element based on provided properties and click it
-- "type": Type text into the previously found element
-- "press_enter": Press Enter key on the previously found element
-- "scroll": Scroll the page (specify direction: "up", "down", "to_top", "to_bottom" and amount in pixels)
-- "scroll_to_element": Scroll until a specific element is visible
-- "new_tab": Open a new browser tab
-- "close_tab": Close the current tab
+def validate_actions(llm_response):
+    try:
+        actions = response_actions(llm_response)
+    except ValueError as e:
+        return [], [str(e)]
+    valid = []
+    errors = []
+    for action in actions:
+        error = validate_action(action)
+        if error:
+            errors.append(error)
+        else:
+            valid.append(action)
+    return valid, errors
+
+def record_response_stat(name):
+    session = active_session()
+    if session is not None:
+        session.response_stats[name] += 1
+    metrics_sink.increment(f"llm_{name}")
+
+def use_cached_response(cache_key, user_message):
+    cached_response = llm_cache.get(cache_key)
+    if cached_response is None:
+        return None
+    json_content = extract_json_from_text(cached_response)
+    actions, errors = validate_actions(json_content) if json_content else ([], ["invalid"])
+    if errors and not actions:
+        llm_cache.discard(cache_key)
+        return None
+    for action in actions:
+        if isinstance(action.get("element_properties"), dict):
+            action["element_properties"].pop("handle", None)
+    json_content = {"actions": actions}
+    print("Using cached LLM response")
+    conversation_history = current_session().conversation_history
+    conversation_history.append(user_message)
+    conversation_history.append({"role": "assistant", "content": cached_response})
+    return json_content
+
+HTML_SECTION_PATTERN = re.compile(r"\nHTML Elements:\n[\s\S]*?(?=\nCurrent browser state:|\nBrowser state unknown|$)")
+
+def strip_element_dump(message):
+    content = message.get("content", "")
+    if message.get("role") != "user" or "\nHTML Elements:\n" not in content:
+        return message
+    return {"role": "user", "content": HTML_SECTION_PATTERN.sub("\nHTML Elements: (omitted, superseded by a newer page)", content, count=1)}
+
+def digest_line(message):
+    content = message.get("content", "")
+    if message.get("role") == "user":
+        return "User: " + content.split("\n", 1)[0][:160]
+    parsed = extract_json_from_text(content) if content.lstrip().startswith(("{", "[", "`")) else None
+    if parsed is None:
+        return "Assistant: " + content.split("\n", 1)[0][:160]
+    steps = []
+    try:
+        actions = response_actions(parsed)
+    except ValueError:
+        actions = []
+    for action in actions:
+        if not isinstance(action, dict):
+            continue
+        detail = action.get("url") or action.get("text") or action.get("description") or ""
+        steps.append(f"{action.get('action')} {str(detail)[:40]}".strip())
+    return "Assistant actions: " + ("; ".join(steps) if steps else "none")
+
+def message_tokens(messages):
+    return sum(estimate_tokens(message.get("content", "")) + 4 for message in messages)
+
+def compact_history(session, html=None):
+    history = session.conversation_history
+    pinned = len(history)
+    if not (html or "").startswith("Snapshot #"):
+        baseline = f"\nHTML Elements:\nSnapshot #{session.dom_snapshot['id']} (full)"
+        for index in range(len(history) - 1, -1, -1):
+            if history[index].get("role") == "user" and baseline in history[index].get("content", ""):
+                pinned = index
+                break
+    for index in range(pinned):
+        history[index] = strip_element_dump(history[index])
+
+    if message_tokens(history) <= HISTORY_TOKEN_BUDGET:
+        return
+    evicted = 0
+    while evicted < pinned and message_tokens(history[evicted:]) > HISTORY_TOKEN_BUDGET // 2:
+        session.history_digest.append(digest_line(history[evicted]))
+        evicted += 1
+    if history[evicted:evicted + 1] and history[evicted].get("role") == "assistant" and evicted < pinned:
+        session.history_digest.append(digest_line(history[evicted]))
+        evicted += 1
+    del history[:evicted]
+    del session.history_digest[:-HISTORY_DIGEST_LINES]
+    print(f"Compacted conversation history: {evicted} messages folded into the digest")
+
+def record_request_tokens(messages, usage=None):
+    usage_stats = current_session().token_usage
+    estimated = message_tokens(messages)
+    reported = getattr(usage, "prompt_tokens", None) if usage else None
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    cached = getattr(details, "cached_tokens", None) if details else None
+    usage_stats["requests"] += 1
+    usage_stats["input_tokens"] += reported or estimated
+    usage_stats["reported_input_tokens"] += reported or 0
+    usage_stats["cached_input_tokens"] += cached or 0
+    usage_stats["last_request"] = {
+        "estimated_input_tokens": estimated,
+        "prefix_tokens": message_tokens(messages[:1]),
+        "history_tokens": message_tokens(messages[1:-1]),
+        "current_tokens": message_tokens(messages[-1:]),
+        "reported_input_tokens": reported,
+        "cached_input_tokens": cached,
+    }
+    cached_note = f", {cached} cached" if cached else ""
+    print(f"LLM request: ~{estimated} input tokens (prefix {usage_stats['last_request']['prefix_tokens']}, history {usage_stats['last_request']['history_tokens']}, current {usage_stats['last_request']['current_tokens']}){cached_note}")
+
+def build_llm_request(command, html=None, page_state=None):
+    system_message = {
+        "role": "system", 
+        "content": """You are a web automation agent. You understand user commands and can perform actions like navigating websites, finding elements dynamically, clicking, typing, etc.
+
+Your primary task is to generate actions to complete web tasks. Instead of using fixed CSS selectors, you should identify elements based on their attributes like text content, aria-labels, placeholders, or other identifying features.
+
+IMPORTANT: Always provide your responses in valid JSON format. Do not include any explanations, markdown formatting, or narrative text outside the JSON.
+
+CRITICAL: Be aware of the current state of the browser. If you are already on a website, do not navigate to it again. Continue from the current page state.
+
+Available actions:
+- "navigate": Go to a specific URL (only use if not already on the site)
+- "find_and_click": Find an element based on provided properties and click it
+- "type": Type text into the previously found element
+- "press_enter": Press Enter key on the previously found element
+- "scroll": Scroll the page (specify direction: "up", "down", "to_top", "to_bottom" and amount in pixels)
+- "scroll_to_element": Scroll until a specific element is visible
+- "new_tab": Open a new browser tab
+- "close_tab": Close the current tab
 - "switch_tab": Switch to a different tab by index or URL
 - "refresh_page": Refresh the current page
 - "go_back": Navigate back in browser history
@@ -224,6 +1649,7 @@ Available actions:
 - "complete": Signal task completion
 
 For finding elements, provide "element_properties" containing attributes that uniquely identify the element like:
+- handle: The element's handle from the HTML Elements list (preferred whenever the element is listed with one)
 - tag: The element's HTML tag (input, button, a, etc.)
 - text: Visible text of the element
 - id: Element's ID attribute
@@ -234,17 +1660,25 @@ For finding elements, provide "element_properties" containing attributes that un
 
 Example for finding a search box:
 "element_properties": {"tag": "input", "aria-label": "Search", "placeholder": "Search"}
-""" + few_shot_examples
+
+Example for an element listed with a handle:
+"element_properties": {"handle": "k412", "tag": "button", "text": "Sign in"}
+""" + (ELEMENT_ROW_LEGEND if ELEMENT_ENCODING == "ranked" else "") + few_shot_examples
     }
 
-    try:
-        current_url = driver.current_url
-        page_title = driver.title
-        current_tab_index = get_current_tab_index()
-        tab_count = len(driver.window_handles)
-        browser_state = f"Current browser state: URL={current_url}, Title={page_title}, Tab {current_tab_index+1} of {tab_count}"
-    except:
-        browser_state = "Browser state unknown"
+    session = current_session()
+    driver = session.driver
+    if page_state is not None:
+        browser_state = f"Current page state (fetched without the browser): URL={page_state['url']}, Title={page_state['title']}"
+    else:
+        try:
+            current_url = driver.current_url
+            page_title = driver.title
+            current_tab_index = get_current_tab_index()
+            tab_count = len(driver.window_handles)
+            browser_state = f"Current browser state: URL={current_url}, Title={page_title}, Tab {current_tab_index+1} of {tab_count}"
+        except:
+            browser_state = "Browser state unknown"
     
     if html:
         user_message = {
@@ -257,29 +1691,59 @@ Example for finding a search box:
             "content": f"Command: {command}\n{browser_state}"
         }
     
-    messages = [system_message] + conversation_history + [user_message]
+    compact_history(session, html)
+    messages = [system_message]
+    if session.history_digest:
+        messages.append({"role": "user", "content": "Summary of earlier turns in this session:\n" + "\n".join(session.history_digest)})
+    messages += session.conversation_history + [user_message]
+    
+    return messages, user_message, browser_state
+
+def send_command_to_llm(command, html=None, use_cache=True, request=None, history=None):
+    session = current_session()
+    if history is None:
+        history = session.conversation_history
+    
+    messages, user_message, browser_state = request or build_llm_request(command, html)
     
-    if len(messages) > 10:
-        messages = [system_message] + messages[-9:]
+    cache_key = None
+    if use_cache and LLM_CACHE_ENABLED and not html:
+        cache_key = llm_cache_key(command, browser_state)
+        json_content = use_cached_response(cache_key, user_message)
+        if json_content:
+            return json_content
     
     max_retries = 3
     for attempt in range(max_retries):
+        if attempt:
+            record_response_stat("retries")
         try:
-            completion = client.chat.completions.create(
-                messages=messages,
-                max_tokens=512,
-                temperature=0.1
-            )
+            with span("llm_request", mode="sync"):
+                completion = client.chat.completions.create(
+                    messages=messages,
+                    max_tokens=512,
+                    temperature=0.1,
+                    **structured_output_options()
+                )
+            record_request_tokens(messages, getattr(completion, "usage", None))
             
-            response = completion.choices[0].message.content
+            response = completion.choices[0].message.content or ""
             
             json_content = extract_json_from_text(response)
+            actions, errors = validate_actions(json_content) if json_content is not None else ([], ["no JSON object found"])
+            if errors:
+                record_response_stat("validation_failures")
+                print(f"Invalid LLM response: {'; '.join(errors[:3])}")
             
-            if json_content:
-                conversation_history.append(user_message)
-                conversation_history.append({"role": "assistant", "content": response})
-                return json_content
+            if actions or (json_content is not None and not errors):
+                history.append(user_message)
+                history.append({"role": "assistant", "content": response})
+                if cache_key and not errors:
+                    llm_cache.put(cache_key, response)
+                return {"actions": actions}
             
+            if structured_output_options():
+                continue
             if attempt < max_retries - 1:
                 messages.append({"role": "assistant", "content": response})
                 messages.append({
@@ -288,88 +1752,218 @@ Example for finding a search box:
                 })
         except Exception as e:
             print(f"API error on attempt {attempt+1}: {str(e)}")
-            time.sleep(0.5)
+            metrics_sink.increment("llm_errors")
+            if not disable_structured_output(e):
+                break
     
+    metrics_sink.increment("llm_failures")
     print("Failed to get valid JSON after multiple attempts.")
     return json.dumps({"actions": []})
 
 def extract_json_from_text(text):
+    start = time.perf_counter()
+    try:
+        return scan_json(text)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics_sink.observe("json_extraction_seconds", elapsed)
+        session = active_session()
+        if session is not None:
+            session.response_stats["extraction_seconds"] += elapsed
+
+JSON_DECODER = json.JSONDecoder()
+JSON_START_PATTERN = re.compile(r"[\[{]")
+
+def scan_json(text):
     try:
-        json_obj = json.loads(text)
-        return json_obj
+        return json.loads(text)
     except json.JSONDecodeError:
         pass
     
-    code_block_pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
-    code_matches = re.findall(code_block_pattern, text)
-    
-    for match in code_matches:
-        try:
-            json_obj = json.loads(match)
-            return json_obj
-        except json.JSONDecodeError:
-            continue
-    
-    json_pattern = r"{[\s\S]*}"
-    json_matches = re.findall(json_pattern, text)
-    
-    for match in json_matches:
-        try:
-            json_obj = json.loads(match)
-            return json_obj
-        except json.JSONDecodeError:
-            continue
-    
-    array_pattern = r"\[\s*{[\s\S]*}\s*\]"
-    array_matches = re.findall(array_pattern, text)
-    
-    for match in array_matches:
+    first_array = None
+    position = 0
+    while True:
+        match = JSON_START_PATTERN.search(text, position)
+        if not match:
+            return first_array
         try:
-            json_obj = json.loads(match)
-            return json_obj
+            value, end = JSON_DECODER.raw_decode(text, match.start())
         except json.JSONDecodeError:
+            position = match.start() + 1
             continue
-    
-    return None
+        if isinstance(value, dict):
+            return value
+        if first_array is None and isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+            first_array = value
+        position = end
 
-def find_element_by_properties(element_properties, timeout=0.5):
-    is_search_element = element_properties.get('is_search', False) or (
-        ('type' in element_properties and element_properties['type'] == 'search') or
-        ('placeholder' in element_properties and isinstance(element_properties['placeholder'], str) and 'search' in element_properties['placeholder'].lower()) or
-        ('aria-label' in element_properties and isinstance(element_properties['aria-label'], str) and 'search' in element_properties['aria-label'].lower()) or
-        ('class' in element_properties and isinstance(element_properties['class'], str) and ('search' in element_properties['class'].lower() or 'query' in element_properties['class'].lower())) or
-        ('id' in element_properties and isinstance(element_properties['id'], str) and ('search' in element_properties['id'].lower() or 'query' in element_properties['id'].lower()))
-    )
+FAST_SEARCH_SELECTORS = [
+    "//textarea[@aria-label='Search']",
+    "//input[@aria-label='Search']",
+    "//input[@name='q']",
+    "//input[@type='search']",
+]
 
-    if is_search_element:
-        fast_selectors = [
-            "//textarea[@aria-label='Search']",
-            "//input[@aria-label='Search']",
-            "//input[@name='q']",
-            "//input[@type='search']",
-        ]
-        for selector in fast_selectors:
-            try:
-                element = driver.find_element(By.XPATH, selector)
-                if element.is_displayed():
-                    return element
-            except Exception:
-                continue
+COMMON_SEARCH_SELECTORS = [
+    "//input[@type='search']",
+    "//input[@name='q']",
+    "//input[@aria-label='Search']",
+    "//input[contains(@placeholder, 'search')]",
+    "//input[contains(@placeholder, 'Search')]",
+    "//input[contains(@class, 'search')]",
+    "//textarea[contains(@placeholder, 'Search')]",
+    "//textarea[@aria-label='Search']"
+]
 
-    wait = WebDriverWait(driver, timeout)
+BATCHED_LOCATOR_JS = """
+var plan = arguments[0];
+var host = window.location.host;
 
-    if 'id' in element_properties:
-        try:
-            element = wait.until(EC.element_to_be_clickable((By.ID, element_properties['id'])))
-            return element
-        except Exception:
-            pass
+function isVisible(el) {
+    var rect = el.getBoundingClientRect();
+    if (rect.width <= 0 || rect.height <= 0) {
+        return false;
+    }
+    var style = window.getComputedStyle(el);
+    return style.display !== 'none' && style.visibility !== 'hidden';
+}
+
+function byXPath(xpath, requireVisible) {
+    var result;
+    try {
+        result = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    } catch (e) {
+        return null;
+    }
+    for (var i = 0; i < result.snapshotLength; i++) {
+        var node = result.snapshotItem(i);
+        if (node.nodeType === 1 && (!requireVisible || isVisible(node))) {
+            return node;
+        }
+    }
+    return null;
+}
+
+function xpathLiteral(value) {
+    if (value.indexOf("'") === -1) {
+        return "'" + value + "'";
+    }
+    if (value.indexOf('"') === -1) {
+        return '"' + value + '"';
+    }
+    return null;
+}
+
+function selectorFor(el, matched) {
+    if (el.id && xpathLiteral(el.id) && document.querySelectorAll('[id=' + JSON.stringify(el.id) + ']').length === 1) {
+        return "//*[@id=" + xpathLiteral(el.id) + "]";
+    }
+    if (matched) {
+        return matched;
+    }
+    var steps = [];
+    for (var node = el; node && node.nodeType === 1; node = node.parentElement) {
+        var index = 1;
+        for (var sibling = node.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+            if (sibling.tagName === node.tagName) {
+                index++;
+            }
+        }
+        steps.unshift(node.tagName.toLowerCase() + '[' + index + ']');
+    }
+    return '/' + steps.join('/');
+}
+
+function found(el, strategy, matched) {
+    return [el, strategy, selectorFor(el, matched), host];
+}
+
+function scanSearchInputs() {
+    var inputs = document.querySelectorAll('input, textarea');
+    for (var i = 0; i < inputs.length; i++) {
+        var el = inputs[i];
+        var type = (el.getAttribute('type') || '').toLowerCase();
+        var name = (el.getAttribute('name') || '').toLowerCase();
+        var placeholder = (el.getAttribute('placeholder') || '').toLowerCase();
+        var aria = (el.getAttribute('aria-label') || '').toLowerCase();
+        var id = (el.getAttribute('id') || '').toLowerCase();
+        if ((type === 'search' || name === 'q' || placeholder.includes('search') ||
+                aria.includes('search') || id.includes('search')) && isVisible(el)) {
+            return el;
+        }
+    }
+    return null;
+}
+
+var learned = plan.learned[host];
+var el = learned ? byXPath(learned, true) : null;
+if (el) {
+    return [el, 'learned', learned, host];
+}
+
+for (var i = 0; i < plan.fast.length; i++) {
+    el = byXPath(plan.fast[i], true);
+    if (el) {
+        return found(el, 'fast_search', plan.fast[i]);
+    }
+}
+
+if (plan.id) {
+    el = document.getElementById(plan.id);
+    if (el && isVisible(el) && !el.disabled) {
+        return found(el, 'id', null);
+    }
+}
+
+if (plan.xpath) {
+    el = byXPath(plan.xpath, true) || byXPath(plan.xpath, false);
+    if (el) {
+        return found(el, 'xpath', plan.xpath);
+    }
+}
+
+for (var j = 0; j < plan.common.length; j++) {
+    el = byXPath(plan.common[j], true);
+    if (el) {
+        return found(el, 'common_search', plan.common[j]);
+    }
+}
+
+if (plan.scan) {
+    el = scanSearchInputs();
+    if (el) {
+        return found(el, 'search_scan', null);
+    }
+}
+
+return [null, null, null, host];
+"""
+
+def record_locator_hit(strategy):
+    locator_stats = current_session().locator_stats
+    locator_stats[strategy] = locator_stats.get(strategy, 0) + 1
+    metrics_sink.increment("element_lookups", tags={"strategy": strategy})
 
+def format_locator_stats():
+    locator_stats = current_session().locator_stats
+    return ', '.join(f"{strategy}={count}" for strategy, count in sorted(locator_stats.items(), key=lambda item: -item[1]))
+
+NON_ATTRIBUTE_PROPERTIES = ('tag', 'location', 'is_search', 'handle')
+
+def href_fragment(value):
+    value = str(value)
+    if value.startswith(('http://', 'https://', '/', '#')) or '/' not in value:
+        return value
+    return value[value.index('/'):]
+
+def build_property_xpath(element_properties):
     xpath_conditions = []
     tag = element_properties.get('tag', '*')
     for attr, value in element_properties.items():
-        if attr == 'tag':
+        if attr in NON_ATTRIBUTE_PROPERTIES:
             continue
+        elif attr == 'href':
+            xpath_conditions.append(f"contains(@href, '{href_fragment(value)}')")
         elif attr == 'text':
             xpath_conditions.append(f"contains(text(), '{value}')")
         elif attr == 'class':
@@ -382,76 +1976,342 @@ def find_element_by_properties(element_properties, timeout=0.5):
         else:
             xpath_conditions.append(f"@{attr}='{value}'")
     if xpath_conditions:
-        xpath = f"//{tag}[{' and '.join(xpath_conditions)}]"
+        return f"//{tag}[{' and '.join(xpath_conditions)}]"
+    return None
+
+FIND_BY_HANDLE_JS = """
+var el = document.querySelector('[' + arguments[0] + '="' + arguments[1] + '"]');
+if (!el || !el.isConnected) {
+    return null;
+}
+var rect = el.getBoundingClientRect();
+var style = window.getComputedStyle(el);
+if (rect.width > 0 && rect.height > 0 && style.display !== 'none' && style.visibility !== 'hidden') {
+    return el;
+}
+return null;
+"""
+
+def find_element_by_handle(handle):
+    if not isinstance(handle, str) or not re.fullmatch(r"[a-z0-9]+", handle):
+        return None
+    try:
+        return current_session().driver.execute_script(FIND_BY_HANDLE_JS, HANDLE_ATTRIBUTE, handle)
+    except Exception:
+        return None
+
+class SelectorCache:
+    def __init__(self, path=None, max_entries=5000, save_interval=5):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self.entries = {}
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = time.time()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Could not load selector cache {path}: {str(e)}")
+
+    @staticmethod
+    def key(element_properties):
+        normalized = {
+            attr: ' '.join(value.split()) if isinstance(value, str) else value
+            for attr, value in element_properties.items()
+            if attr not in ('handle', 'is_search', 'description')
+        }
+        return json.dumps(normalized, sort_keys=True)
+
+    @staticmethod
+    def confidence(entry):
+        return (entry["hits"] + 1) / (entry["hits"] + entry["misses"] + 2)
+
+    def candidates(self, key):
+        with self.lock:
+            return {
+                domain: entry["selector"]
+                for domain, entry in self.entries.get(key, {}).items()
+                if self.confidence(entry) >= SELECTOR_MIN_CONFIDENCE
+            }
+
+    def record(self, key, domain, strategy, selector, tried):
+        if not domain:
+            return
+        with self.lock:
+            domains = self.entries.setdefault(key, {})
+            entry = domains.get(domain)
+            if entry is not None and (strategy == "learned" or tried):
+                self.changed.add((key, domain))
+            if strategy == "learned" and entry is not None:
+                entry.update({"hits": entry["hits"] + 1, "misses": 0, "used": time.time()})
+            elif entry is not None and tried:
+                entry["misses"] += 1
+                if entry["misses"] >= SELECTOR_MAX_MISSES or self.confidence(entry) < SELECTOR_MIN_CONFIDENCE:
+                    self._remove(key, domain)
+                    entry = None
+            elif entry is not None and self.confidence(entry) < SELECTOR_MIN_CONFIDENCE:
+                self._remove(key, domain)
+                entry = None
+            if entry is None and selector:
+                domains[domain] = {"selector": selector, "strategy": strategy, "hits": 1, "misses": 0, "used": time.time()}
+                self.changed.add((key, domain))
+                self._evict()
+            if not domains:
+                del self.entries[key]
+            self.dirty = True
+            if time.time() - self.last_save >= self.save_interval:
+                self._save()
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self._save()
+
+    def _remove(self, key, domain):
+        del self.entries[key][domain]
+        self.changed.add((key, domain))
+
+    def _evict(self):
+        entries = [(entry["used"], key, domain) for key, domains in self.entries.items() for domain, entry in domains.items()]
+        for _, key, domain in sorted(entries)[:max(0, len(entries) - self.max_entries)]:
+            self._remove(key, domain)
+            if not self.entries[key]:
+                del self.entries[key]
+
+    def _merge(self, on_disk):
+        merged = {key: dict(domains) for key, domains in on_disk.items()}
+        for key, domain in self.changed:
+            entry = self.entries.get(key, {}).get(domain)
+            if entry is not None:
+                merged.setdefault(key, {})[domain] = entry
+            elif domain in merged.get(key, {}):
+                del merged[key][domain]
+        self.entries = {key: domains for key, domains in merged.items() if domains}
+        self._evict()
+        self.changed = set()
+        return self.entries
+
+    def _save(self):
+        self.dirty = False
+        self.last_save = time.time()
+        if not self.path:
+            self.changed = set()
+            return
         try:
-            element = wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
+            update_json_file(self.path, self._merge)
+        except OSError as e:
+            print(f"Could not save selector cache {self.path}: {str(e)}")
+
+selector_cache = SelectorCache(SELECTOR_CACHE_PATH, SELECTOR_CACHE_MAX_ENTRIES)
+
+def find_element_by_properties(element_properties, timeout=0.5):
+    with span("find_element"):
+        return locate_element(element_properties, timeout)
+
+def locate_element(element_properties, timeout=0.5):
+    session = current_session()
+    driver = session.driver
+    if 'handle' in element_properties:
+        handle = element_properties['handle']
+        element = find_element_by_handle(handle)
+        if element:
+            record_locator_hit("handle")
             return element
-        except Exception:
-            pass
+        record_locator_hit("stale_handle")
+        print(f"Handle {handle} is stale, falling back to property search")
+        element_properties = {
+            **{k: v for k, v in element_properties.items() if k not in ('handle', 'location')},
+            **session.element_handles.get(handle, {})
+        }
 
-    if is_search_element:
-        common_search_selectors = [
-            "//input[@type='search']",
-            "//input[@name='q']",
-            "//input[@aria-label='Search']",
-            "//input[contains(@placeholder, 'search')]",
-            "//input[contains(@placeholder, 'Search')]",
-            "//input[contains(@class, 'search')]",
-            "//textarea[contains(@placeholder, 'Search')]",
-            "//textarea[@aria-label='Search']"
-        ]
-        for selector in common_search_selectors:
-            try:
-                element = driver.find_element(By.XPATH, selector)
-                if element.is_displayed():
-                    return element
-            except Exception:
-                continue
+    is_search_element = element_properties.get('is_search', False) or (
+        ('type' in element_properties and element_properties['type'] == 'search') or
+        ('placeholder' in element_properties and isinstance(element_properties['placeholder'], str) and 'search' in element_properties['placeholder'].lower()) or
+        ('aria-label' in element_properties and isinstance(element_properties['aria-label'], str) and 'search' in element_properties['aria-label'].lower()) or
+        ('class' in element_properties and isinstance(element_properties['class'], str) and ('search' in element_properties['class'].lower() or 'query' in element_properties['class'].lower())) or
+        ('id' in element_properties and isinstance(element_properties['id'], str) and ('search' in element_properties['id'].lower() or 'query' in element_properties['id'].lower()))
+    )
+
+    xpath = build_property_xpath(element_properties)
+    cache_key = selector_cache.key(element_properties) if SELECTOR_CACHE_ENABLED else None
+    plan = {
+        "learned": selector_cache.candidates(cache_key) if cache_key else {},
+        "fast": FAST_SEARCH_SELECTORS if is_search_element else [],
+        "id": element_properties.get('id') if isinstance(element_properties.get('id'), str) else None,
+        "xpath": xpath,
+        "common": COMMON_SEARCH_SELECTORS if is_search_element else [],
+        "scan": bool(is_search_element),
+    }
 
-    if is_search_element:
+    deadline = time.time() + timeout
+    domain = None
+    while True:
         try:
-            search_js = """
-            var inputs = document.querySelectorAll('input, textarea');
-            for (var i=0; i<inputs.length; i++) {
-                var el = inputs[i];
-                var type = el.getAttribute('type') || '';
-                var placeholder = el.getAttribute('placeholder') || '';
-                var aria = el.getAttribute('aria-label') || '';
-                var name = el.getAttribute('name') || '';
-                var id = el.getAttribute('id') || '';
-                if (
-                    type.toLowerCase() === 'search' ||
-                    name.toLowerCase() === 'q' ||
-                    placeholder.toLowerCase().includes('search') ||
-                    aria.toLowerCase().includes('search') ||
-                    id.toLowerCase().includes('search')
-                ) {
-                    var rect = el.getBoundingClientRect();
-                    if (rect.width > 0 && rect.height > 0 && window.getComputedStyle(el).display !== 'none' && window.getComputedStyle(el).visibility !== 'hidden') {
-                        return el;
-                    }
-                }
-            }
-            return null;
-            """
-            element = driver.execute_script(search_js)
-            if element:
-                return element
+            element, strategy, selector, domain = driver.execute_script(BATCHED_LOCATOR_JS, plan)
         except Exception:
-            pass
+            element = None
+        if element:
+            record_locator_hit(strategy)
+            if cache_key:
+                selector_cache.record(cache_key, domain, strategy, selector, domain in plan["learned"])
+            return element
+        if time.time() >= deadline:
+            break
+        time.sleep(LOCATOR_POLL_INTERVAL)
 
+    if cache_key and domain in plan["learned"]:
+        selector_cache.record(cache_key, domain, None, None, True)
+    record_locator_hit("miss")
     return None
 
-last_found_element = None
-
 def random_delay(min_seconds=0.1, max_seconds=0.3):
     delay = random.uniform(min_seconds, max_seconds)
     time.sleep(delay)
     return delay
 
+ACTIVITY_TRACKER_JS = """
+(function () {
+    if (window.__wepilotActivity) return;
+    const tracker = window.__wepilotActivity = {pending: 0, lastNetwork: performance.now(), lastMutation: performance.now()};
+    const started = () => { tracker.pending++; tracker.lastNetwork = performance.now(); };
+    const finished = () => { tracker.pending = Math.max(0, tracker.pending - 1); tracker.lastNetwork = performance.now(); };
+
+    if (window.fetch) {
+        const originalFetch = window.fetch;
+        window.fetch = function () {
+            started();
+            return originalFetch.apply(this, arguments).finally(finished);
+        };
+    }
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        started();
+        this.addEventListener('loadend', finished, {once: true});
+        return originalSend.apply(this, arguments);
+    };
+    if (window.PerformanceObserver) {
+        try {
+            new PerformanceObserver(() => { tracker.lastNetwork = performance.now(); }).observe({type: 'resource'});
+        } catch (e) {}
+    }
+
+    const observe = () => new MutationObserver(() => { tracker.lastMutation = performance.now(); })
+        .observe(document.documentElement, {subtree: true, childList: true, characterData: true});
+    if (document.documentElement) observe();
+    else document.addEventListener('DOMContentLoaded', observe, {once: true});
+})();
+"""
+
+WAIT_FOR_READY_JS = ACTIVITY_TRACKER_JS + """
+const [timeoutMs, networkIdleMs, quietMs] = arguments;
+const done = arguments[arguments.length - 1];
+const tracker = window.__wepilotActivity;
+const start = performance.now();
+(function check() {
+    const now = performance.now();
+    const ready = document.readyState === 'complete' && tracker.pending === 0 &&
+        now - tracker.lastNetwork >= networkIdleMs && now - tracker.lastMutation >= quietMs;
+    if (ready || now - start >= timeoutMs) {
+        done({ready: ready, pending: tracker.pending});
+        return;
+    }
+    setTimeout(check, 50);
+})();
+"""
+
+WAIT_FOR_STABLE_ELEMENT_JS = """
+const [element, timeoutMs] = arguments;
+const done = arguments[arguments.length - 1];
+const start = performance.now();
+let previous = null;
+(function check() {
+    if (!element.isConnected) {
+        done('detached');
+        return;
+    }
+    const rect = element.getBoundingClientRect();
+    const box = [rect.x, rect.y, rect.width, rect.height].join(',');
+    const hit = rect.width && rect.height ? document.elementFromPoint(rect.x + rect.width / 2, rect.y + rect.height / 2) : null;
+    const uncovered = hit !== null && (hit === element || element.contains(hit) || hit.contains(element));
+    if (box === previous && uncovered) {
+        done('stable');
+        return;
+    }
+    if (performance.now() - start >= timeoutMs) {
+        done('timeout');
+        return;
+    }
+    previous = box;
+    setTimeout(check, 30);
+})();
+"""
+
+def record_wait(kind, seconds):
+    wait_stats = current_session().wait_stats
+    wait_stats[kind] = wait_stats.get(kind, 0.0) + seconds
+    record_span("wait", time.perf_counter() - seconds, seconds, {"kind": kind})
+    return seconds
+
+def wait_for_page_ready(timeout=READY_TIMEOUT, kind="load"):
+    driver = current_session().driver
+    start = time.time()
+    deadline = start + timeout
+    while time.time() < deadline:
+        try:
+            state = driver.execute_async_script(WAIT_FOR_READY_JS, int((deadline - time.time()) * 1000), NETWORK_IDLE_MS, DOM_QUIET_MS)
+            if not (state or {}).get("ready"):
+                print(f"Page not idle after {timeout}s ({(state or {}).get('pending', '?')} requests in flight), continuing")
+            break
+        except Exception:
+            time.sleep(LOCATOR_POLL_INTERVAL)
+    return record_wait(kind, time.time() - start)
+
+def wait_for_page_load(extra_delay=0):
+    if PACING_PROFILE == "fast":
+        return wait_for_page_ready()
+    driver = current_session().driver
+    start = time.time()
+    WebDriverWait(driver, 5).until(
+        lambda d: d.execute_script('return document.readyState') == 'complete'
+    )
+    time.sleep(extra_delay)
+    return record_wait("load", time.time() - start)
+
+def wait_for_element(element):
+    if PACING_PROFILE != "fast":
+        return record_wait("element", random_delay(0.1, 0.2))
+    start = time.time()
+    try:
+        current_session().driver.execute_async_script(WAIT_FOR_STABLE_ELEMENT_JS, element, 1000)
+    except Exception:
+        pass
+    return record_wait("element", time.time() - start)
+
+def settle_after_action(min_seconds=0.2, max_seconds=0.5):
+    if PACING_PROFILE == "fast":
+        return wait_for_page_ready(SETTLE_TIMEOUT, "settle")
+    return record_wait("settle", random_delay(min_seconds, max_seconds))
+
+def type_text(element, text):
+    if PACING_PROFILE == "fast":
+        element.send_keys(text)
+        return
+    for char in text:
+        element.send_keys(char)
+        record_wait("typing", random_delay(0.01, 0.05))
+
+def format_wait_stats(wait_stats):
+    return ', '.join(f"{kind} {seconds:.2f}s" for kind, seconds in sorted(wait_stats.items(), key=lambda item: -item[1]))
+
 def execute_action(action):
-    global last_found_element
+    session = current_session()
+    driver = session.driver
     
+    session.last_action_error = None
     try:
         action_type = action.get("action")
         description = action.get("description", action_type.replace("_", " ").title())
@@ -460,11 +2320,9 @@ def execute_action(action):
         if action_type == "navigate":
             url = action.get("url")
             driver.get(url)
-            WebDriverWait(driver, 5).until(
-                lambda d: d.execute_script('return document.readyState') == 'complete'
-            )
-            time.sleep(0.5)
+            wait_for_page_load(0.5)
             print(f"Navigated to: {url}")
+            report_navigation_savings(driver)
             
             try:
                 handle_common_popups()
@@ -482,7 +2340,7 @@ def execute_action(action):
             
             if element:
                 driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
-                random_delay(0.1, 0.2)
+                wait_for_element(element)
                 
                 try:
                     WebDriverWait(driver, 2).until(EC.element_to_be_clickable((By.XPATH, f"//{element.tag_name}[@id='{element.get_attribute('id')}']" if element.get_attribute('id') else ".")))
@@ -495,7 +2353,7 @@ def execute_action(action):
                     print(f"Direct click failed: {str(e)}, trying JavaScript click")
                     driver.execute_script("arguments[0].click();", element)
                 
-                last_found_element = element
+                session.last_found_element = element
                 print(f"Found and clicked element: {element_properties}")
             else:
                 if is_search:
@@ -521,29 +2379,31 @@ def execute_action(action):
                         success = driver.execute_script(search_js)
                         if success:
                             print("Found and clicked search element using JavaScript")
-                            random_delay(0.3, 0.6)
+                            settle_after_action(0.3, 0.6)
                             return False
                     except Exception as e:
                         print(f"JavaScript search interaction failed: {str(e)}")
                 
                 print(f"Could not find element with properties: {element_properties}")
-                driver.save_screenshot("element_not_found.png")
+                session.last_action_error = "element_not_found"
+                capture_diagnostic("element_not_found")
                 
         elif action_type == "type":
             text = action.get("text")
-            if action.get("use_previous_element") and last_found_element:
-                element = last_found_element
+            if action.get("use_previous_element") and session.last_found_element:
+                element = session.last_found_element
             elif "element_properties" in action:
                 element = find_element_by_properties(action.get("element_properties"))
-                last_found_element = element
+                session.last_found_element = element
             else:
                 print("No element specified for typing")
+                session.last_action_error = "element_not_found"
                 return
                 
             if element:
                 WebDriverWait(driver, 5).until(EC.visibility_of(element))
                 driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
-                random_delay(0.1, 0.2)
+                wait_for_element(element)
                 
                 try:
                     element.clear()
@@ -551,21 +2411,21 @@ def execute_action(action):
                     element.send_keys(Keys.CONTROL + "a")
                     element.send_keys(Keys.DELETE)
                 
-                for char in text:
-                    element.send_keys(char)
-                    random_delay(0.01, 0.05)
+                type_text(element, text)
                 print(f"Typed '{text}' into element")
             else:
                 print("Element for typing not found")
+                session.last_action_error = "element_not_found"
                 
         elif action_type == "press_enter":
-            if action.get("use_previous_element") and last_found_element:
-                element = last_found_element
+            if action.get("use_previous_element") and session.last_found_element:
+                element = session.last_found_element
             elif "element_properties" in action:
                 element = find_element_by_properties(action.get("element_properties"))
-                last_found_element = element
+                session.last_found_element = element
             else:
                 print("No element specified for pressing Enter")
+                session.last_action_error = "element_not_found"
                 return
                 
             if element:
@@ -573,6 +2433,7 @@ def execute_action(action):
                 print("Pressed Enter on element")
             else:
                 print("Element for pressing Enter not found")
+                session.last_action_error = "element_not_found"
                 
         elif action_type == "scroll":
             direction = action.get("direction", "down")
@@ -602,19 +2463,26 @@ def execute_action(action):
                 alignment = action.get("alignment", "center")
                 driver.execute_script(f"arguments[0].scrollIntoView({{block: '{alignment}'}});", element)
                 print(f"Scrolled to element: {element_properties}")
-                last_found_element = element
+                session.last_found_element = element
             else:
                 print("Element to scroll to not found")
+                session.last_action_error = "element_not_found"
                 
         elif action_type == "new_tab":
             url = action.get("url", "about:blank")
-            driver.execute_script(f"window.open('{url}');")
-            driver.switch_to.window(driver.window_handles[-1])
+            if FAST_LOAD:
+                driver.execute_script("window.open('about:blank');")
+                driver.switch_to.window(driver.window_handles[-1])
+                apply_resource_blocking(driver)
+                if url != "about:blank":
+                    driver.get(url)
+            else:
+                driver.execute_script(f"window.open('{url}');")
+                driver.switch_to.window(driver.window_handles[-1])
             print(f"Opened new tab with URL: {url}")
             if url != "about:blank":
-                WebDriverWait(driver, 5).until(
-                    lambda d: d.execute_script('return document.readyState') == 'complete'
-                )
+                wait_for_page_load()
+                report_navigation_savings(driver)
                 try:
                     handle_common_popups()
                 except:
@@ -623,6 +2491,7 @@ def execute_action(action):
         elif action_type == "close_tab":
             if len(driver.window_handles) > 1:
                 current_tab = driver.current_window_handle
+                remember_tab_origins(driver)
                 driver.close()
                 driver.switch_to.window(driver.window_handles[0])
                 print("Closed current tab and switched to first tab")
@@ -650,28 +2519,29 @@ def execute_action(action):
         
         elif action_type == "refresh_page":
             driver.refresh()
-            WebDriverWait(driver, 5).until(
-                lambda d: d.execute_script('return document.readyState') == 'complete'
-            )
+            wait_for_page_load()
             print("Page refreshed")
+            report_navigation_savings(driver)
             
         elif action_type == "go_back":
             driver.back()
-            WebDriverWait(driver, 5).until(
-                lambda d: d.execute_script('return document.readyState') == 'complete'
-            )
+            wait_for_page_load()
             print("Navigated back")
+            report_navigation_savings(driver)
             
         elif action_type == "go_forward":
             driver.forward()
-            WebDriverWait(driver, 5).until(
-                lambda d: d.execute_script('return document.readyState') == 'complete'
-            )
+            wait_for_page_load()
             print("Navigated forward")
+            report_navigation_savings(driver)
             
         elif action_type == "wait":
             seconds = action.get("seconds", 0.5)
-            time.sleep(seconds)
+            if PACING_PROFILE == "fast":
+                wait_for_page_ready(seconds, "requested")
+            else:
+                time.sleep(seconds)
+                record_wait("requested", seconds)
             print(f"Waited: {seconds} seconds")
             
         elif action_type == "complete":
@@ -681,48 +2551,214 @@ def execute_action(action):
         else:
             print(f"Unknown action: {action_type}")
         
-        random_delay(0.2, 0.5)
+        settle_after_action()
         return False
         
     except Exception as e:
         print(f"Action execution failed: {str(e)}")
-        driver.save_screenshot(f"error_{action_type}.png")
+        session.last_action_error = str(e) or type(e).__name__
+        capture_diagnostic(f"error_{action_type}")
         return False
 
-def handle_common_popups():
-    common_button_texts = ['Accept', 'Accept All', 'I Agree', 'Accept Cookies', 'OK', 'Got it', 'Agree', 'Close']
-    
-    for text in common_button_texts:
-        try:
-            buttons = driver.find_elements(By.XPATH, f"//*[contains(text(), '{text}')]")
-            for button in buttons:
-                if button.is_displayed():
-                    button.click()
-                    print(f"Closed popup with button: {text}")
-                    return
-        except:
-            continue
-    
-    common_close_selectors = [
-        "//button[@aria-label='Close']",
-        "//button[contains(@class, 'close')]",
-        "//div[contains(@class, 'popup')]//button",
-        "//div[contains(@class, 'cookie')]//button",
-        "//div[contains(@class, 'consent')]//button"
-    ]
-    
-    for selector in common_close_selectors:
+class ScreenshotWriter:
+    def __init__(self, directory, per_session=20, max_total=500, queue_size=32):
+        self.directory = directory
+        self.per_session = per_session
+        self.max_total = max_total
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.ring = {}
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"written": 0, "rate_limited": 0, "dropped": 0, "deleted": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def submit(self, session_id, name, data):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="wepilot-screenshots", daemon=True)
+                self.thread.start()
         try:
-            buttons = driver.find_elements(By.XPATH, selector)
-            for button in buttons:
-                if button.is_displayed():
-                    button.click()
-                    print(f"Closed popup with selector: {selector}")
-                    return
-        except:
-            continue
+            self.queue.put_nowait(((os.getpid(), session_id), name, data))
+            return True
+        except queue.Full:
+            self.count("dropped")
+            return False
+
+    def end_session(self, session_id):
+        if self.thread is not None:
+            self.queue.put(((os.getpid(), session_id), None, None))
+
+    def flush(self):
+        if self.thread is not None:
+            self.queue.join()
+
+    def _run(self):
+        while True:
+            key, name, data = self.queue.get()
+            try:
+                if name is None:
+                    with self.lock:
+                        self.ring.pop(key, None)
+                else:
+                    self._write(key, name, data)
+            except OSError as e:
+                print(f"Could not write screenshot {name}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, key, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(base64.b64decode(data) if isinstance(data, str) else data)
+        with self.lock:
+            self.stats["written"] += 1
+            ring = self.ring.setdefault(key, deque())
+            ring.append(path)
+            expired = [ring.popleft() for _ in range(len(ring) - self.per_session)]
+        self._delete(expired)
+        self._prune()
+
+    def _prune(self):
+        with os.scandir(self.directory) as entries:
+            files = sorted((entry.stat().st_mtime, entry.path) for entry in entries if entry.is_file())
+        self._delete(path for _, path in files[:max(0, len(files) - self.max_total)])
+
+    def _delete(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+                self.count("deleted")
+            except OSError:
+                pass
+
+screenshot_writer = ScreenshotWriter(SCREENSHOT_DIR, SCREENSHOTS_PER_SESSION, SCREENSHOTS_MAX_TOTAL)
+
+def capture_screenshot(driver):
+    if not hasattr(driver, "execute_cdp_cmd"):
+        return driver.get_screenshot_as_png(), "png"
+    options = {"format": SCREENSHOT_FORMAT}
+    if SCREENSHOT_FORMAT in ("jpeg", "webp"):
+        options["quality"] = SCREENSHOT_QUALITY
+    if SCREENSHOT_SCALE and SCREENSHOT_SCALE != 1:
+        viewport = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})["cssLayoutViewport"]
+        options["clip"] = {
+            "x": viewport["pageX"], "y": viewport["pageY"],
+            "width": viewport["clientWidth"], "height": viewport["clientHeight"],
+            "scale": SCREENSHOT_SCALE,
+        }
+    return driver.execute_cdp_cmd("Page.captureScreenshot", options)["data"], "jpg" if SCREENSHOT_FORMAT == "jpeg" else SCREENSHOT_FORMAT
+
+def capture_diagnostic(label):
+    session = current_session()
+    if not SCREENSHOT_DIR:
+        return None
+    now = time.monotonic()
+    if now - session.last_screenshot < SCREENSHOT_MIN_INTERVAL:
+        screenshot_writer.count("rate_limited")
+        return None
+    session.last_screenshot = now
+    try:
+        with span("screenshot"):
+            data, extension = capture_screenshot(session.driver)
+    except Exception as e:
+        print(f"Could not capture screenshot: {str(e)}")
+        return None
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-p{os.getpid()}-s{session.id}-t{session.task_number}-i{session.iteration}-{re.sub(r'[^A-Za-z0-9_-]', '_', label)}.{extension}"
+    if screenshot_writer.submit(session.id, name, data):
+        return os.path.join(screenshot_writer.directory, name)
+    return None
+
+POPUP_BUTTON_TEXTS = ['Accept', 'Accept All', 'I Agree', 'Accept Cookies', 'OK', 'Got it', 'Agree', 'Close']
+POPUP_CLOSE_SELECTORS = [
+    "button[aria-label='Close']",
+    "button[class*='close']",
+    "div[class*='popup'] button",
+    "div[class*='cookie'] button",
+    "div[class*='consent'] button"
+]
+POPUP_SKIP_AFTER_MISSES = 3
+POPUP_SKIP_SECONDS = 600
+
+DISMISS_POPUP_JS = """
+const [texts, selectors, preferred] = arguments;
+const visible = (element) => {
+    if (!element.getClientRects().length) return false;
+    const style = window.getComputedStyle(element);
+    return style.visibility !== 'hidden' && style.display !== 'none';
+};
+const rules = texts.map(text => 'text:' + text).concat(selectors.map(selector => 'selector:' + selector));
+if (preferred && rules.includes(preferred)) {
+    rules.splice(rules.indexOf(preferred), 1);
+    rules.unshift(preferred);
+}
+
+let textOwners = null;
+const collectTextOwners = () => {
+    textOwners = [];
+    if (!document.body) return;
+    const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+    for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+        const owner = node.parentElement;
+        if (owner && !['SCRIPT', 'STYLE', 'NOSCRIPT'].includes(owner.tagName)) {
+            textOwners.push([node.nodeValue, owner]);
+        }
+    }
+};
+
+for (const rule of rules) {
+    let candidates;
+    if (rule.startsWith('text:')) {
+        if (textOwners === null) collectTextOwners();
+        const text = rule.slice(5);
+        candidates = textOwners.filter(([value]) => value.includes(text)).map(([, owner]) => owner);
+    } else {
+        try {
+            candidates = document.querySelectorAll(rule.slice(9));
+        } catch (e) {
+            continue;
+        }
+    }
+    for (const candidate of candidates) {
+        if (visible(candidate)) {
+            candidate.click();
+            return rule;
+        }
+    }
+}
+return null;
+"""
+
+popup_memo = {}
+popup_memo_lock = threading.Lock()
+
+def handle_common_popups():
+    driver = current_session().driver
+    domain = url_domain(driver.current_url)
+    with popup_memo_lock:
+        memo = dict(popup_memo.setdefault(domain, {"rule": None, "misses": 0, "dismissed": 0, "skip_until": 0.0}))
+    if time.time() < memo["skip_until"]:
+        return None
+
+    rule = driver.execute_script(DISMISS_POPUP_JS, POPUP_BUTTON_TEXTS, POPUP_CLOSE_SELECTORS, memo["rule"])
+    with popup_memo_lock:
+        memo = popup_memo[domain]
+        if rule:
+            memo.update({"rule": rule, "misses": 0, "dismissed": memo["dismissed"] + 1})
+        else:
+            memo["misses"] += 1
+            if memo["misses"] >= POPUP_SKIP_AFTER_MISSES and not memo["dismissed"]:
+                memo.update({"misses": 0, "skip_until": time.time() + POPUP_SKIP_SECONDS})
+    if rule:
+        kind, _, value = rule.partition(":")
+        print(f"Closed popup with {'button' if kind == 'text' else 'selector'}: {value}")
+    return rule
 
 def get_browser_state():
+    driver = current_session().driver
     try:
         return {
             "url": driver.current_url,
@@ -735,147 +2771,1466 @@ def get_browser_state():
         return {"url": "", "title": "", "domain": "", "tab_index": 0, "tab_count": 1}
 
 def get_current_tab_index():
+    driver = current_session().driver
     try:
         current_window = driver.current_window_handle
         return driver.window_handles.index(current_window)
     except:
         return 0
 
-def main():
-    global conversation_history
-    print("Web Automation Agent started.")
-    
-    current_browser_state = get_browser_state()
-    
-    user_instruction = input("Enter your instruction: ")
-    
-    while user_instruction.lower() not in ["exit", "quit", "stop"]:
-        print("Processing instruction...")
-        print(f"Task: {user_instruction}")
-        
-        current_browser_state = get_browser_state()
-        print(f"Current browser state: {current_browser_state['url']}")
-        
-        if not any(msg.get("content") == user_instruction for msg in conversation_history if msg.get("role") == "user"):
-            augmented_instruction = f"{user_instruction} (Current page: {current_browser_state['title']} - {current_browser_state['url']})"
-            conversation_history.append({"role": "user", "content": augmented_instruction})
+def url_domain(url):
+    return url.split("//")[-1].split("/")[0] if "//" in url else ""
+
+def normalize_instruction(instruction):
+    return ' '.join(instruction.split()).rstrip('.!?')
+
+def template_pattern(template):
+    parts = re.split(r"\{param(\d+)\}", template)
+    seen = set()
+    pattern = ''
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            pattern += re.escape(part)
+        elif part in seen:
+            pattern += f"(?P=param{part})"
+        else:
+            seen.add(part)
+            pattern += f"(?P<param{part}>.+?)"
+    return re.compile(pattern, re.IGNORECASE)
+
+def whole_word_pattern(values):
+    return re.compile('|'.join(rf"(?<!\w){re.escape(value)}(?!\w)" for value in sorted(values, key=len, reverse=True)))
+
+def templatize_plan(instruction, actions):
+    normalized = normalize_instruction(instruction).lower()
+    params = []
+    for action in actions:
+        text = action.get("text")
+        if action.get("action") == "type" and isinstance(text, str):
+            value = ' '.join(text.lower().split())
+            if value and value not in params and whole_word_pattern([value]).search(normalized):
+                params.append(value)
+
+    template = normalized
+    if params:
+        template = whole_word_pattern(params).sub(lambda match: f"{{param{params.index(match.group(0))}}}", normalized)
+    if len(re.sub(r"\{param\d+\}", " ", template).split()) < 2:
+        template, params = normalized, []
+
+    templated_actions = []
+    for action in actions:
+        action = dict(action)
+        for index, value in enumerate(params):
+            marker = f"{{param{index}}}"
+            if action.get("action") == "type" and ' '.join(str(action.get("text", "")).lower().split()) == value:
+                action["text"] = marker
+            if isinstance(action.get("url"), str):
+                url = urlparse(action["url"])
+                action["url"] = url._replace(
+                    path=re.sub(re.escape(quote(value)), f"{{param{index}:path}}", url.path, flags=re.IGNORECASE),
+                    query=re.sub(re.escape(quote_plus(value)), marker, url.query, flags=re.IGNORECASE),
+                ).geturl()
+        templated_actions.append(action)
+    return template, templated_actions
+
+def fill_plan(actions, params):
+    filled = []
+    for action in actions:
+        action = dict(action)
+        for name, value in params.items():
+            marker = f"{{{name}}}"
+            if action.get("text") == marker:
+                action["text"] = value
+            if isinstance(action.get("url"), str):
+                action["url"] = action["url"].replace(marker, quote_plus(value)).replace(f"{{{name}:path}}", quote(value))
+        filled.append(action)
+    return filled
+
+@contextlib.contextmanager
+def locked_file(path):
+    with open(f"{path}.lock", 'a+') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+def update_json_file(path, merge, indent=None):
+    with locked_file(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                on_disk = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            on_disk = {}
+        merged = merge(on_disk)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, indent=indent)
+        os.replace(temp_path, path)
+    return merged
+
+class PlanStore:
+    def __init__(self, path=None):
+        self.path = path
+        self.plans = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.plans = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Could not load plan store {path}: {str(e)}")
+
+    def find(self, instruction, domain):
+        instruction = normalize_instruction(instruction)
+        candidates = []
+        with self.lock:
+            for plan_domain, plans in self.plans.items():
+                for template, plan in plans.items():
+                    actions = plan["actions"]
+                    if plan_domain != domain and actions[0].get("action") != "navigate":
+                        continue
+                    try:
+                        match = template_pattern(template).fullmatch(instruction)
+                    except re.error as e:
+                        print(f"Ignoring unusable plan template {template!r}: {str(e)}")
+                        continue
+                    if match:
+                        candidates.append((plan_domain == domain, plan.get("uses", 0), plan_domain, template, actions, match.groupdict()))
+        if not candidates:
+            return None
+        _, _, plan_domain, template, actions, params = max(candidates, key=lambda candidate: candidate[:2])
+        return {"domain": plan_domain, "template": template, "actions": fill_plan(actions, params)}
+
+    def record(self, instruction, domain, actions):
+        if not actions:
+            return
+        if actions[0].get("action") == "navigate":
+            domain = url_domain(actions[0].get("url", "")) or domain
+        template, templated_actions = templatize_plan(instruction, actions)
+        with self.lock:
+            plans = self.plans.setdefault(domain, {})
+            uses = plans.get(template, {}).get("uses", 0)
+            plans[template] = {"actions": templated_actions, "uses": uses + 1, "updated": time.time()}
+            self._save()
+        print(f"Saved plan for {domain}: {template}")
+
+    def _merge(self, on_disk):
+        merged = {domain: dict(plans) for domain, plans in on_disk.items()}
+        for domain, plans in self.plans.items():
+            stored = merged.setdefault(domain, {})
+            for template, plan in plans.items():
+                if plan.get("updated", 0) >= stored.get(template, {}).get("updated", 0):
+                    stored[template] = plan
+        return merged
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            self.plans = update_json_file(self.path, self._merge, indent=2)
+        except OSError as e:
+            print(f"Could not save plan store {self.path}: {str(e)}")
+
+plan_store = PlanStore(PLAN_STORE_PATH)
+
+def recordable_action(action):
+    recorded = dict(action)
+    properties = recorded.get("element_properties")
+    if isinstance(properties, dict) and "handle" in properties:
+        recorded["element_properties"] = {
+            **current_session().element_handles.get(properties["handle"], {}),
+            **{k: v for k, v in properties.items() if k != "handle"}
+        }
+    return recorded
+
+def execute_and_record(action, executed_actions):
+    with span("action", action=action.get("action")):
+        result = execute_action(action)
+    if current_session().last_action_error is None and action.get("action") != "complete":
+        executed_actions.append(recordable_action(action))
+    return result
+
+def replay_plan(plan, executed_actions):
+    print(f"Replaying recorded plan for {plan['domain']}: {plan['template']}")
+    current_domain = get_browser_state().get("domain", "")
+    for index, action in enumerate(plan["actions"]):
+        if index == 0 and action.get("action") == "navigate" and url_domain(action.get("url", "")) == current_domain:
+            print(f"Already on {current_domain}. Skipping navigation.")
+            continue
+        completed = execute_and_record(action, executed_actions)
+        last_action_error = current_session().last_action_error
+        if last_action_error is not None:
+            print(f"Replayed step failed ({last_action_error}). Falling back to the LLM.")
+            return False
+        if completed:
+            break
+    return True
+
+def response_actions(llm_response):
+    if isinstance(llm_response, list):
+        return llm_response
+    elif isinstance(llm_response, dict) and "actions" in llm_response:
+        if not isinstance(llm_response["actions"], list):
+            raise ValueError("actions is not a list")
+        return llm_response["actions"]
+    elif isinstance(llm_response, dict):
+        return [llm_response]
+    raise ValueError(f"Unexpected response format: {type(llm_response)}")
+
+class ActionStreamParser:
+    def __init__(self):
+        self.text = ''
+        self.position = 0
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.array_depth = None
+        self.object_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        actions = []
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = bool(self.stack)
+            elif char in '{[':
+                self.stack.append(char)
+                if char == '[' and self.array_depth is None and self._starts_action_array():
+                    self.array_depth = len(self.stack)
+                elif char == '{' and self.array_depth is not None and len(self.stack) == self.array_depth + 1:
+                    self.object_start = self.position
+            elif char in '}]' and self.stack:
+                self.stack.pop()
+                if char == '}' and self.object_start is not None and len(self.stack) == self.array_depth:
+                    try:
+                        action = json.loads(self.text[self.object_start:self.position + 1])
+                        if isinstance(action, dict):
+                            actions.append(action)
+                    except json.JSONDecodeError:
+                        pass
+                    self.object_start = None
+            self.position += 1
+        return actions
+
+    def _starts_action_array(self):
+        if len(self.stack) == 1:
+            return True
+        return len(self.stack) == 2 and self.stack[0] == '{' and re.search(r'"actions"\s*:\s*$', self.text[:self.position]) is not None
+
+def stream_command_to_llm(command, html=None, use_cache=True):
+    session = current_session()
+    conversation_history = session.conversation_history
+    
+    messages, user_message, browser_state = build_llm_request(command, html)
+    
+    cache_key = None
+    if use_cache and LLM_CACHE_ENABLED and not html:
+        cache_key = llm_cache_key(command, browser_state)
+        json_content = use_cached_response(cache_key, user_message)
+        if json_content:
+            yield from response_actions(json_content)
+            return
+    
+    parser = ActionStreamParser()
+    streamed = 0
+    yielded = 0
+    recorded = False
+    usage = None
+    stream_start = time.perf_counter()
+    try:
+        try:
+            stream = client.chat.completions.create(
+                messages=messages,
+                max_tokens=512,
+                temperature=0.1,
+                stream=True,
+                **structured_output_options()
+            )
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    continue
+                for action in parser.feed(content):
+                    streamed += 1
+                    error = validate_action(action)
+                    if error:
+                        record_response_stat("validation_failures")
+                        print(f"Dropped invalid streamed action: {error}")
+                        continue
+                    if not yielded:
+                        metrics_sink.observe("llm_first_action_seconds", time.perf_counter() - stream_start)
+                    yielded += 1
+                    yield action
+        except Exception as e:
+            print(f"Streaming API error: {str(e)}")
+            metrics_sink.increment("llm_errors")
+            disable_structured_output(e)
+        record_span("llm_request", stream_start, time.perf_counter() - stream_start, {"mode": "stream"})
+        record_request_tokens(messages, usage)
         
-        llm_response = send_command_to_llm(user_instruction)
+        json_content = extract_json_from_text(parser.text) if parser.text else None
+        if json_content:
+            conversation_history.append(user_message)
+            conversation_history.append({"role": "assistant", "content": parser.text})
+            recorded = True
+            actions, errors = validate_actions(json_content)
+            if cache_key and not errors:
+                llm_cache.put(cache_key, parser.text)
+            try:
+                remaining = response_actions(json_content)[streamed:]
+            except ValueError:
+                remaining = []
+            yield from (action for action in remaining if validate_action(action) is None)
+        elif not yielded:
+            print("Streamed response was not valid JSON. Falling back to a regular request.")
+            recorded = True
+            yield from response_actions(send_command_to_llm(command, html, use_cache=False))
+    finally:
+        if not recorded and parser.text:
+            conversation_history.append(user_message)
+            conversation_history.append({"role": "assistant", "content": parser.text})
+
+def plan_actions(command, html=None):
+    if STREAM_LLM_RESPONSES:
+        print("Streaming actions from the LLM...")
+        return stream_command_to_llm(command, html)
+    llm_response = send_command_to_llm(command, html)
+    print(f"Planning actions: {str(llm_response)[:100]}...")
+    return response_actions(llm_response)
+
+NON_MUTATING_ACTIONS = {"wait", "scroll", "scroll_to_element"}
+
+PAGE_VERSION_JS = """
+if (!window.__wpVersionObserver && document.documentElement) {
+    window.__wpVersion = 0;
+    window.__wpVersionToken = Math.random().toString(36).slice(2);
+    window.__wpVersionObserver = new MutationObserver(function (records) {
+        window.__wpVersion += records.length;
+    });
+    window.__wpVersionObserver.observe(document.documentElement, {
+        childList: true,
+        subtree: true,
+        characterData: true,
+        attributes: true,
+        attributeFilter: ['class', 'style', 'hidden', 'disabled', 'href', 'role', 'aria-label', 'aria-hidden', 'aria-expanded', 'placeholder', 'value', 'open']
+    });
+}
+return [window.location.href, window.__wpVersionToken || null, window.__wpVersion || 0];
+"""
+
+prefetch_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SESSIONS, thread_name_prefix="wepilot-prefetch")
+
+def page_version():
+    driver = current_session().driver
+    try:
+        return driver.current_window_handle, tuple(driver.execute_script(PAGE_VERSION_JS))
+    except Exception:
+        return None
+
+def continuation_prompt(user_instruction, browser_state):
+    return f"Continue executing the instruction: '{user_instruction}'. Current page: {browser_state['title']} - {browser_state['url']}. What's the next step?"
+
+class Speculation:
+    def __init__(self, session, user_instruction):
+        self.session = session
+        self.user_instruction = user_instruction
+        self.future = None
+        self.command = None
+        self.html = None
+        self.request = None
+        self.browser_state = None
+        self.version = None
+        self.messages = []
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        print("Remaining actions do not change the page, requesting the next step early")
+        with span("snapshot", speculative=True):
+            self.html = extract_page_snapshot(query=self.user_instruction)
+        self.browser_state = get_browser_state()
+        self.version = page_version()
+        self.command = continuation_prompt(self.user_instruction, self.browser_state)
+        self.request = build_llm_request(self.command, self.html)
+        self.started = time.perf_counter()
+        self.session.prefetch_stats["started"] += 1
+        self.future = prefetch_executor.submit(self._request)
+
+    def _request(self):
+        activate_session(self.session)
         try:
-            print(f"Planning actions: {str(llm_response)[:100]}...")
-            
-            if isinstance(llm_response, list):
-                actions = llm_response
-            elif isinstance(llm_response, dict) and "actions" in llm_response:
-                actions = llm_response["actions"]
-            elif isinstance(llm_response, dict):
-                actions = [llm_response]
+            return send_command_to_llm(self.command, self.html, use_cache=False, request=self.request, history=self.messages)
+        finally:
+            self.finished = time.perf_counter()
+
+    def take(self):
+        if self.future is None:
+            return None
+        stats = self.session.prefetch_stats
+        if self.version is None or page_version() != self.version:
+            self.discard("Page changed while the next step was being prefetched, discarding it")
+            return None
+        actions_done = time.perf_counter()
+        with span("prefetch_wait"):
+            llm_response = self.future.result()
+        overlap = min(self.finished, actions_done) - self.started
+        self.session.conversation_history.extend(self.messages)
+        stats["used"] += 1
+        stats["overlap_seconds"] += overlap
+        metrics_sink.increment("prefetch_used")
+        metrics_sink.observe("prefetch_overlap_seconds", overlap)
+        print(f"Using prefetched plan ({overlap:.2f}s of LLM time overlapped with actions)")
+        return response_actions(llm_response)
+
+    def discard(self, reason=None):
+        if self.future is None:
+            return
+        if reason:
+            print(reason)
+        self.future.cancel()
+        reset_dom_snapshot()
+        self.future = None
+        self.session.prefetch_stats["discarded"] += 1
+        metrics_sink.increment("prefetch_discarded")
+
+def execute_planned_actions(actions, current_domain, executed_actions, speculation=None):
+    count = 0
+    completed = False
+    for index, action in enumerate(actions):
+        if speculation and speculation.future is None and isinstance(actions, list) and actions[-1].get("action") != "wait" and all(
+            remaining.get("action") in NON_MUTATING_ACTIONS for remaining in actions[index:]
+        ):
+            speculation.start()
+        if index == 0 and action.get("action") == "navigate":
+            target_domain = url_domain(action.get("url", ""))
+            if current_domain and target_domain and current_domain == target_domain:
+                print(f"Already on {current_domain}. Skipping navigation.")
+                continue
+        count += 1
+        if execute_and_record(action, executed_actions):
+            completed = True
+            break
+    if hasattr(actions, "close"):
+        actions.close()
+    return count, completed
+
+class HttpFetcher:
+    def __init__(self, timeout=FAST_PATH_TIMEOUT, max_idle=FAST_PATH_IDLE_CONNECTIONS):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "reused": 0, "bytes": 0}
+
+    def _connection(self, scheme, host):
+        with self.lock:
+            self.stats["requests"] += 1
+            connections = self.idle.get((scheme, host))
+            if connections:
+                self.stats["reused"] += 1
+                return connections.pop(), True
+            self.stats["connections"] += 1
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(host, timeout=self.timeout), False
+
+    def _release(self, scheme, host, connection):
+        with self.lock:
+            connections = self.idle.setdefault((scheme, host), [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def request(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError(f"cannot fetch {url}")
+        path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+        headers = {
+            "User-Agent": BROWSER_USER_AGENT,
+            "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": "gzip, deflate",
+            "Accept-Language": "en-US,en;q=0.9",
+        }
+        for attempt in range(2):
+            connection, reused = self._connection(parsed.scheme, parsed.netloc)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read(FAST_PATH_MAX_BYTES + 1)
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused and not attempt:
+                    continue
+                raise
+            oversized = len(body) > FAST_PATH_MAX_BYTES
+            if oversized or response.will_close:
+                connection.close()
             else:
-                raise ValueError(f"Unexpected response format: {type(llm_response)}")
-            
-            if actions and actions[0].get("action") == "navigate":
-                target_url = actions[0].get("url", "")
-                current_domain = current_browser_state.get("domain", "")
-                target_domain = target_url.split("//")[-1].split("/")[0] if "//" in target_url else ""
-                
-                if current_domain and target_domain and current_domain == target_domain:
-                    print(f"Already on {current_domain}. Skipping navigation.")
-                    actions = actions[1:]
-                
+                self._release(parsed.scheme, parsed.netloc, connection)
+            with self.lock:
+                self.stats["bytes"] += len(body)
+            return response, body[:FAST_PATH_MAX_BYTES], oversized
+
+    def fetch(self, url):
+        for _ in range(FAST_PATH_MAX_REDIRECTS + 1):
+            response, body, oversized = self.request(url)
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            encoding = (response.getheader("Content-Encoding") or "").lower()
+            if encoding == "gzip" and not oversized:
+                body = gzip.decompress(body)
+            elif encoding == "deflate" and not oversized:
+                body = zlib.decompress(body, -zlib.MAX_WBITS if body[:1] != b"x" else zlib.MAX_WBITS)
+            content_type = (response.getheader("Content-Type") or "").lower()
+            charset = re.search(r"charset=([\w-]+)", content_type)
+            try:
+                html = body.decode(charset.group(1) if charset else "utf-8", errors="replace")
+            except LookupError:
+                html = body.decode("utf-8", errors="replace")
+            return {"url": url, "status": response.status, "content_type": content_type, "html": html, "bytes": len(body), "oversized": oversized}
+        raise ValueError(f"too many redirects from {url}")
+
+    def close(self):
+        with self.lock:
+            connections = [connection for pooled in self.idle.values() for connection in pooled]
+            self.idle.clear()
+        for connection in connections:
+            connection.close()
+
+http_fetcher = HttpFetcher()
+
+def page_title(html):
+    match = re.search(r"<title[^>]*>(.*?)</title>", html, re.I | re.S)
+    return ' '.join(html_entities.unescape(match.group(1)).split()) if match else ""
+
+def fast_path_target(actions):
+    if not isinstance(actions, list) or not actions or actions[0].get("action") != "navigate":
+        return None
+    url = actions[0].get("url") or ""
+    if not url.startswith(("http://", "https://")):
+        return None
+    if all(action.get("action") in NON_MUTATING_ACTIONS or action.get("action") == "complete" for action in actions[1:]):
+        return url
+    return None
+
+def answers_task(actions):
+    for action in actions:
+        if action.get("action") == "complete":
+            return True
+        if action.get("action") not in NON_MUTATING_ACTIONS:
+            return False
+    return not actions
+
+def static_page_problem(page, elements):
+    if page["status"] != 200:
+        return f"HTTP {page['status']}"
+    if "html" not in page["content_type"]:
+        return f"content type {page['content_type'] or 'unknown'}"
+    if page["oversized"]:
+        return "page too large"
+    for pattern in FAST_PATH_JS_MARKERS:
+        if re.search(pattern, page["html"], re.I):
+            return "page needs JavaScript"
+    if len(elements) < FAST_PATH_MIN_ELEMENTS:
+        return f"only {len(elements)} interactive elements"
+    return None
+
+def try_fast_path(user_instruction, actions):
+    url = fast_path_target(actions)
+    if url is None:
+        return actions, None, None
+    stats = current_session().fast_path_stats
+    stats["tasks"] += 1
+    planned = actions
+    fetched = 0
+    reason = f"more than {FAST_PATH_MAX_PAGES} pages"
+    for _ in range(FAST_PATH_MAX_PAGES):
+        try:
+            with span("http_fetch"):
+                page = http_fetcher.fetch(url)
+        except (http.client.HTTPException, OSError, ValueError, zlib.error) as e:
+            reason = f"fetch failed: {str(e)}"
+            break
+        with span("parse_elements", source="http"):
+            elements = select_elements(collect_interactive_elements(page["html"], candidate_chars(5000)), user_instruction)
+        reason = static_page_problem(page, elements)
+        if reason:
+            break
+        fetched += 1
+        stats["pages"] += 1
+        stats["bytes"] += page["bytes"]
+        state = {"url": page["url"], "title": page_title(page["html"]), "domain": url_domain(page["url"])}
+        print(f"Fast path: fetched {page['url']} without the browser ({page['bytes'] / 1024:.0f} KB, {len(elements)} elements)")
+        if planned is actions and any(action.get("action") == "complete" for action in planned):
+            planned = []
+        else:
+            html = render_elements(elements)
+            prompt = continuation_prompt(user_instruction, state)
+            planned = response_actions(send_command_to_llm(prompt, html, use_cache=False, request=build_llm_request(prompt, html, state)))
+        if answers_task(planned):
+            print("Fast path: task answered without loading the page in Chrome.")
+            stats["answered"] += 1
+            metrics_sink.increment("fast_path", tags={"outcome": "answered"})
+            return [], state, "answered"
+        url = fast_path_target(planned)
+        if url is None:
+            reason = "next step needs the browser"
+            if planned[0].get("action") != "navigate":
+                planned = [{"action": "navigate", "url": state["url"]}] + planned
+            break
+    outcome = "escalated" if fetched else "skipped"
+    print(f"Fast path {outcome}: {reason}. Loading {planned[0].get('url')} in Chrome.")
+    stats[outcome] += 1
+    metrics_sink.increment("fast_path", tags={"outcome": outcome})
+    return planned, None, outcome
+
+def format_fast_path_stats(stats):
+    return f"{stats['answered']} of {stats['tasks']} eligible tasks answered without the browser, {stats['escalated']} escalated, {stats['skipped']} skipped; {stats['pages']} pages fetched ({stats['bytes'] / 1024:.0f} KB, {http_fetcher.stats['reused']} of {http_fetcher.stats['requests']} requests on reused connections)"
+
+def run_task(user_instruction):
+    session = current_session()
+    session.task_number += 1
+    session.iteration = 0
+    session.trace = []
+    session.trace_origin = time.perf_counter()
+    with span("task"):
+        result = perform_task(user_instruction)
+    
+    metrics_sink.increment("tasks", tags={"status": result["status"]})
+    metrics_sink.observe("task_iterations", result["iterations"])
+    timings = summarize_trace(session.trace)
+    result["timings"] = {name: round(phase["seconds"], 3) for name, phase in timings.items()}
+    print("Phase timings: " + ', '.join(f"{name} {phase['seconds']:.2f}s x{phase['count']}" for name, phase in sorted(timings.items(), key=lambda item: -item[1]["seconds"]) if name != "task"))
+    if TRACE_DIR:
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            base = os.path.join(TRACE_DIR, f"task-{session.id}-{int(time.time() * 1000)}")
+            export_trace(f"{base}.json")
+            export_trace(f"{base}.trace.json", format="chrome")
+            print(f"Trace written to {base}.trace.json")
+        except OSError as e:
+            print(f"Could not write trace: {str(e)}")
+    return result
+
+def perform_task(user_instruction):
+    session = current_session()
+    conversation_history = session.conversation_history
+    print("Processing instruction...")
+    print(f"Task: {user_instruction}")
+    
+    current_browser_state = get_browser_state()
+    print(f"Current browser state: {current_browser_state['url']}")
+    reset_dom_snapshot()
+    
+    if not any(msg.get("content") == user_instruction for msg in conversation_history if msg.get("role") == "user"):
+        augmented_instruction = f"{user_instruction} (Current page: {current_browser_state['title']} - {current_browser_state['url']})"
+        conversation_history.append({"role": "user", "content": augmented_instruction})
+    
+    start_domain = current_browser_state.get("domain", "")
+    executed_actions = []
+    task_succeeded = False
+    replayed = False
+    fast_path_state = None
+    result = {"instruction": user_instruction, "session": session.id, "replayed": False, "fast_path": None, "iterations": 0}
+    start_usage = (session.token_usage["requests"], session.token_usage["input_tokens"])
+    start_waits = dict(session.wait_stats)
+    start_responses = dict(session.response_stats)
+    start_prefetch = dict(session.prefetch_stats)
+    
+    recorded_plan = plan_store.find(user_instruction, start_domain) if PLAN_REPLAY_ENABLED else None
+    if recorded_plan:
+        replayed = True
+        result["replayed"] = True
+        task_succeeded = replay_plan(recorded_plan, executed_actions)
+    
+    if not replayed:
+        try:
+            actions = plan_actions(user_instruction)
+            if FETCH_MODE == "tiered":
+                actions = list(actions)
+            if isinstance(actions, list):
+                print(f"{len(actions)} initial actions identified.")
+            if FETCH_MODE == "tiered":
+                actions, fast_path_state, result["fast_path"] = try_fast_path(user_instruction, actions)
+            if fast_path_state:
+                speculation = None
+                action_count, task_succeeded = 1, True
+            else:
+                speculation = Speculation(session, user_instruction) if SPECULATIVE_PREFETCH else None
+                current_domain = "" if result["fast_path"] == "escalated" else start_domain
+                action_count, _ = execute_planned_actions(actions, current_domain, executed_actions, speculation)
         except (json.JSONDecodeError, ValueError) as e:
             print(f"Error processing LLM response: {str(e)}")
-            print("Please try again with a different instruction.")
-            user_instruction = input("Enter your next instruction (or type 'exit' to quit): ")
-            continue
-        
-        if not actions:
+            result.update({"status": "error", "error": str(e), "url": get_browser_state()["url"], "actions": len(executed_actions)})
+            return result
+    
+        if not action_count:
             print("No actions to execute. Please try a different instruction.")
-            user_instruction = input("Enter your next instruction (or type 'exit' to quit): ")
-            continue
-            
-        print(f"{len(actions)} initial actions identified.")
-        
-        for action in actions:
-            if execute_action(action):
-                break
-        
-        max_iterations = 10
-        iteration = 0
+            result.update({"status": "no_actions", "url": get_browser_state()["url"], "actions": 0})
+            return result
+    
+    iteration = 0
+    if replayed or not SPECULATIVE_PREFETCH:
+        speculation = None
+    
+    while not task_succeeded and iteration < MAX_ITERATIONS:
+        iteration += 1
+        session.iteration = iteration
         
-        while iteration < max_iterations:
-            iteration += 1
-            
-            try:
-                html_content = preprocess_html(driver.page_source)
+        try:
+            next_actions = speculation.take() if speculation else None
+            if next_actions is not None:
+                print(f"\nIteration {iteration}: Continuing with the prefetched plan...")
+                current_browser_state = speculation.browser_state
+            else:
+                with span("snapshot"):
+                    html_content = extract_page_snapshot(query=user_instruction)
                 print(f"\nIteration {iteration}: Analyzing page and determining next steps...")
-                
                 current_browser_state = get_browser_state()
-                continuation_prompt = f"Continue executing the instruction: '{user_instruction}'. Current page: {current_browser_state['title']} - {current_browser_state['url']}. What's the next step?"
-                llm_response = send_command_to_llm(continuation_prompt, html_content)
+            speculation = Speculation(session, user_instruction) if SPECULATIVE_PREFETCH else None
+            try:
+                if next_actions is None:
+                    next_actions = plan_actions(continuation_prompt(user_instruction, current_browser_state), html_content)
+                if isinstance(next_actions, list) and next_actions:
+                    print(f"Executing {len(next_actions)} actions for iteration {iteration}...")
                 
-                print(f"Next actions planned: {str(llm_response)[:100]}...")
+                action_count, task_complete = execute_planned_actions(next_actions, current_browser_state.get("domain", ""), executed_actions, speculation)
                 
-                try:
-                    if isinstance(llm_response, list):
-                        next_actions = llm_response
-                    elif isinstance(llm_response, dict) and "actions" in llm_response:
-                        next_actions = llm_response["actions"]
-                    elif isinstance(llm_response, dict):
-                        next_actions = [llm_response]
-                    else:
-                        raise ValueError(f"Unexpected response format: {type(llm_response)}")
-                    
-                    if next_actions and next_actions[0].get("action") == "navigate":
-                        target_url = next_actions[0].get("url", "")
-                        current_domain = current_browser_state.get("domain", "")
-                        target_domain = target_url.split("//")[-1].split("/")[0] if "//" in target_url else ""
-                        
-                        if current_domain and target_domain and current_domain == target_domain:
-                            print(f"Already on {current_domain}. Skipping navigation.")
-                            next_actions = next_actions[1:]
-                    
-                    if not next_actions:
-                        print("Task completed successfully!")
-                        break
-                    
-                    print(f"Executing {len(next_actions)} actions for iteration {iteration}...")
-                    
-                    task_complete = False
-                    for action in next_actions:
-                        if execute_action(action):
-                            task_complete = True
-                            break
-                    
-                    if task_complete:
-                        print("Task completed successfully!")
-                        break
-                        
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(f"Error processing LLM response: {str(e)}")
+                if not action_count or task_complete:
+                    print("Task completed successfully!")
+                    task_succeeded = True
                     break
                     
-            except Exception as e:
-                print(f"Error occurred during execution: {str(e)}")
+            except (json.JSONDecodeError, ValueError) as e:
+                print(f"Error processing LLM response: {str(e)}")
                 break
+                
+        except Exception as e:
+            print(f"Error occurred during execution: {str(e)}")
+            break
+    
+    if speculation:
+        speculation.discard()
+    
+    if iteration >= MAX_ITERATIONS:
+        print("Maximum number of iterations reached. Task may be incomplete.")
+    
+    if task_succeeded and PLAN_REPLAY_ENABLED:
+        plan_store.record(user_instruction, start_domain, executed_actions)
+    if SELECTOR_CACHE_ENABLED:
+        selector_cache.flush()
+    
+    if session.locator_stats:
+        print(f"Element lookups by strategy: {format_locator_stats()}")
+    if FAST_LOAD:
+        savings = session.network_savings
+        print(f"Fast load totals: {savings['blocked_requests']} requests blocked, {savings['loaded_requests']} loaded, {savings['transferred_bytes'] / 1024:.0f} KB transferred")
+    if LLM_CACHE_ENABLED:
+        print(f"LLM cache: {llm_cache.stats['memory_hits']} memory hits, {llm_cache.stats['disk_hits']} disk hits, {llm_cache.stats['misses']} misses")
+    if session.fast_path_stats["tasks"]:
+        print(f"Fast path totals: {format_fast_path_stats(session.fast_path_stats)}")
+    
+    current_browser_state = fast_path_state or get_browser_state()
+    
+    completion_summary = f"Completed task: {user_instruction}. Current page: {current_browser_state['title']} - {current_browser_state['url']}"
+    conversation_history.append({"role": "assistant", "content": completion_summary})
+    
+    if len(conversation_history) > 4:
+        print("\nMemory summary (last 3 tasks):")
+        for i in range(len(conversation_history)-6, len(conversation_history), 2):
+            if i >= 0:
+                print(f"- {conversation_history[i].get('content', '')[:50]}...")
+    
+    task_waits = {kind: seconds - start_waits.get(kind, 0.0) for kind, seconds in session.wait_stats.items() if seconds > start_waits.get(kind, 0.0)}
+    if task_waits:
+        print(f"Time spent waiting ({PACING_PROFILE} pacing): {sum(task_waits.values()):.2f}s ({format_wait_stats(task_waits)})")
+    
+    response_stats = {name: value - start_responses[name] for name, value in session.response_stats.items()}
+    if response_stats["retries"] or response_stats["validation_failures"]:
+        print(f"LLM responses: {response_stats['retries']} retries, {response_stats['validation_failures']} validation failures, {response_stats['extraction_seconds'] * 1000:.1f} ms spent extracting JSON")
+    
+    prefetch_stats = {name: value - start_prefetch[name] for name, value in session.prefetch_stats.items()}
+    if prefetch_stats["started"]:
+        print(f"Speculative prefetch: {prefetch_stats['used']} of {prefetch_stats['started']} used, {prefetch_stats['discarded']} discarded, {prefetch_stats['overlap_seconds']:.2f}s of LLM time overlapped with actions")
+    
+    usage = session.token_usage
+    print(f"LLM input tokens: {usage['input_tokens']} over {usage['requests']} requests ({usage['cached_input_tokens']} served from the provider's prompt cache)")
+    
+    result.update({
+        "status": "completed" if task_succeeded else "incomplete",
+        "url": current_browser_state["url"],
+        "iterations": iteration,
+        "actions": len(executed_actions),
+        "llm_requests": usage["requests"] - start_usage[0],
+        "input_tokens": usage["input_tokens"] - start_usage[1],
+        "wait_seconds": round(sum(task_waits.values()), 3),
+        "prefetch_overlap_seconds": round(prefetch_stats["overlap_seconds"], 3),
+    })
+    return result
+
+class SessionEngine:
+    def __init__(self, max_sessions=MAX_CONCURRENT_SESSIONS, max_browsers=None, warm_browsers=WARM_BROWSERS):
+        self.browser_pool = BrowserPool(max_browsers or max_sessions, warm_browsers)
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix="wepilot-session")
+
+    def submit(self, instruction, session=None):
+        return self.executor.submit(self.run, instruction, session)
+
+    def open_session(self):
+        return AgentSession(self.browser_pool.acquire())
+
+    def close_session(self, session):
+        screenshot_writer.end_session(session.id)
+        self.browser_pool.release(session.driver)
+
+    def run(self, instruction, session=None):
+        owns_session = session is None
+        if owns_session:
+            session = self.open_session()
+        try:
+            with session.lock:
+                activate_session(session)
+                try:
+                    return run_task(instruction)
+                finally:
+                    activate_session(None)
+        finally:
+            if owns_session:
+                self.close_session(session)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        screenshot_writer.flush()
+        http_fetcher.close()
+        stats = self.browser_pool.snapshot()
+        print(f"Browser pool: {stats['launched']} launched, {stats['recycled']} recycled, {stats['resets']} resets, {stats['avg_acquire_seconds']:.2f}s average acquire")
+        self.browser_pool.close()
+
+def reset_conversation(session):
+    session.conversation_history.clear()
+    session.history_digest.clear()
+    session.element_handles.clear()
+    session.last_found_element = None
+    session.last_action_error = None
+
+def bare_domain(domain):
+    domain = domain.lower()
+    return domain[4:] if domain.startswith("www.") else domain
+
+def job_domain(instruction, domain=None, url=None):
+    if url:
+        return url_domain(url).lower()
+    if domain:
+        return domain.lower()
+    match = re.search(r"\b((?:[a-z0-9-]+\.)+[a-z]{2,})\b", instruction.lower())
+    return match.group(1) if match else ""
+
+def domain_matches(session_domain, job):
+    if not session_domain:
+        return False
+    session_domain = bare_domain(session_domain)
+    if job.domain:
+        return session_domain == bare_domain(job.domain) or session_domain.endswith("." + bare_domain(job.domain))
+    return session_domain.split(".")[0] in re.findall(r"[a-z0-9-]+", job.instruction.lower())
+
+class Job:
+    def __init__(self, job_id, instruction, domain=""):
+        self.id = job_id
+        self.instruction = instruction
+        self.domain = domain
+        self.status = "queued"
+        self.result = None
+        self.events = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.session = None
+        self.cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status not in ("queued", "running")
+
+    def emit(self, event_type, **data):
+        with self.cond:
+            self.events.append({"seq": len(self.events), "time": round(time.time(), 3), "type": event_type, **data})
+            self.cond.notify_all()
+
+    def finish(self, event_type, **data):
+        with self.cond:
+            self.status = data.get("status", event_type)
+            self.finished = time.time()
+            self.emit(event_type, **data)
+
+    def describe(self):
+        described = {
+            "id": self.id,
+            "instruction": self.instruction,
+            "domain": self.domain,
+            "status": self.status,
+            "session": self.session,
+            "created": self.created,
+            "queue_seconds": round((self.started or time.time()) - self.created, 3),
+            "run_seconds": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+        }
+        if self.result is not None:
+            described["result"] = self.result
+        return described
+
+class JobScheduler:
+    def __init__(self, max_sessions=MAX_CONCURRENT_SESSIONS, queue_limit=JOB_QUEUE_LIMIT, warm_browsers=WARM_BROWSERS):
+        self.browser_pool = BrowserPool(max_sessions, warm_browsers)
+        self.queue_limit = queue_limit
+        self.queue = deque()
+        self.jobs = OrderedDict()
+        self.cond = threading.Condition()
+        self.job_ids = itertools.count(1)
+        self.stopping = False
+        self.slots = [{"slot": index, "session": None, "domain": "", "busy": False, "jobs": 0} for index in range(max_sessions)]
+        self.finish_times = deque(maxlen=1000)
+        self.stats = {"submitted": 0, "rejected": 0, "cancelled": 0, "affinity_hits": 0, "queue_seconds": 0.0, "run_seconds": 0.0, "finished": 0, "statuses": {}}
+        self.threads = [
+            threading.Thread(target=self._work, args=(slot,), name=f"wepilot-job-{slot['slot']}", daemon=True)
+            for slot in self.slots
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, instruction, job_id=None, domain=None, url=None):
+        with self.cond:
+            if self.stopping or len(self.queue) >= self.queue_limit:
+                self.stats["rejected"] += 1
+                metrics_sink.increment("jobs_rejected")
+                return None
+            job_id = str(job_id or next(self.job_ids))
+            if job_id in self.jobs and not self.jobs[job_id].done:
+                raise ValueError(f"job {job_id} is already queued or running")
+            job = Job(job_id, instruction, job_domain(instruction, domain, url))
+            self.jobs[job_id] = job
+            self.jobs.move_to_end(job_id)
+            self._evict()
+            self.queue.append(job)
+            self.stats["submitted"] += 1
+            job.emit("queued", position=len(self.queue), domain=job.domain)
+            self.cond.notify_all()
+        metrics_sink.increment("jobs_submitted")
+        return job
+
+    def get(self, job_id):
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                return False
+            self.queue.remove(job)
+            job.finish("cancelled")
+            self.stats["cancelled"] += 1
+        return True
+
+    def retry_after(self):
+        with self.cond:
+            finished = self.stats["finished"]
+            average = self.stats["run_seconds"] / finished if finished else 30.0
+            return max(1, math.ceil(average * (len(self.queue) + 1) / len(self.slots)))
+
+    def _evict(self):
+        excess = len(self.jobs) - JOB_HISTORY_LIMIT
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done][:max(0, excess)]:
+            del self.jobs[job_id]
+
+    def _next_job(self, slot):
+        window = list(itertools.islice(self.queue, JOB_AFFINITY_WINDOW))
+        for job in window:
+            if domain_matches(slot["domain"], job):
+                return job, True
+        idle_domains = [other["domain"] for other in self.slots if other is not slot and not other["busy"]]
+        for job in window:
+            if not any(domain_matches(domain, job) for domain in idle_domains):
+                return job, False
+        return None, False
+
+    def _work(self, slot):
+        while True:
+            with self.cond:
+                job = None
+                while job is None and not self.stopping:
+                    if self.queue:
+                        job, affinity = self._next_job(slot)
+                    if job is None:
+                        self.cond.wait()
+                if self.stopping:
+                    return
+                self.queue.remove(job)
+                slot["busy"] = True
+                job.status = "running"
+                job.started = time.time()
+                self.stats["queue_seconds"] += job.started - job.created
+                if affinity:
+                    self.stats["affinity_hits"] += 1
+            metrics_sink.observe("job_queue_seconds", job.started - job.created)
+            self._run(slot, job, affinity)
+            with self.cond:
+                slot["busy"] = False
+                self.stats["finished"] += 1
+                self.stats["run_seconds"] += job.finished - job.started
+                self.stats["statuses"][job.status] = self.stats["statuses"].get(job.status, 0) + 1
+                self.finish_times.append(job.finished)
+                self.cond.notify_all()
+
+    def _drop_session(self, slot):
+        screenshot_writer.end_session(slot["session"].id)
+        slot.update({"session": None, "domain": "", "jobs": 0})
+
+    def _run(self, slot, job, affinity):
+        try:
+            if slot["session"] is not None and not affinity:
+                self.browser_pool.release(slot["session"].driver, count_task=False)
+                self._drop_session(slot)
+            if slot["session"] is None:
+                slot["session"] = AgentSession(self.browser_pool.acquire())
+            else:
+                clear_browser_state(slot["session"].driver)
+            session = slot["session"]
+            job.session = session.id
+            job.emit("started", session=session.id, session_domain=slot["domain"], affinity=affinity)
+            reset_conversation(session)
+
+            def report(name, duration, tags):
+                if name in JOB_PROGRESS_SPANS:
+                    job.emit(name, seconds=round(duration, 3), **tags)
+
+            session.listener = report
+            with session.lock:
+                activate_session(session)
+                try:
+                    result = run_task(job.instruction)
+                finally:
+                    activate_session(None)
+                    session.listener = None
+            slot["domain"] = url_domain(result.get("url", ""))
+            slot["jobs"] += 1
+            if self.browser_pool.count_task(session.driver):
+                self.browser_pool.recycle(session.driver)
+                self._drop_session(slot)
+        except Exception as e:
+            print(f"Job {job.id} failed: {str(e)}")
+            result = {"instruction": job.instruction, "status": "error", "error": str(e) or type(e).__name__}
+            if slot["session"] is not None:
+                self.browser_pool.discard(slot["session"].driver)
+                self._drop_session(slot)
+        job.result = result
+        job.finish("finished", status=result["status"], url=result.get("url", ""))
+        metrics_sink.increment("jobs", tags={"status": job.status})
+
+    def snapshot(self):
+        now = time.time()
+        with self.cond:
+            finished = self.stats["finished"]
+            recent = [finish for finish in self.finish_times if now - finish <= 60]
+            return {
+                "queue_depth": len(self.queue),
+                "queue_limit": self.queue_limit,
+                "running": sum(1 for slot in self.slots if slot["busy"]),
+                "sessions": [
+                    {"slot": slot["slot"], "session": slot["session"].id if slot["session"] else None, "domain": slot["domain"], "busy": slot["busy"], "jobs": slot["jobs"]}
+                    for slot in self.slots
+                ],
+                "submitted": self.stats["submitted"],
+                "rejected": self.stats["rejected"],
+                "cancelled": self.stats["cancelled"],
+                "finished": finished,
+                "statuses": dict(self.stats["statuses"]),
+                "affinity_hits": self.stats["affinity_hits"],
+                "jobs_per_minute": len(recent),
+                "avg_queue_seconds": self.stats["queue_seconds"] / finished if finished else 0.0,
+                "avg_run_seconds": self.stats["run_seconds"] / finished if finished else 0.0,
+                "browser_pool": self.browser_pool.snapshot(),
+            }
+
+    def shutdown(self):
+        with self.cond:
+            self.stopping = True
+            for job in self.queue:
+                job.finish("cancelled")
+            self.queue.clear()
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        for slot in self.slots:
+            if slot["session"] is not None:
+                self.browser_pool.release(slot["session"].driver, count_task=False)
+        screenshot_writer.flush()
+        http_fetcher.close()
+        self.browser_pool.close()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def route(self):
+        url = urlparse(self.path)
+        return [part for part in url.path.split("/") if part], parse_qs(url.query)
+
+    def do_POST(self):
+        parts, _ = self.route()
+        if parts != ["jobs"]:
+            return self.send_json(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self.send_json(400, {"error": "invalid Content-Length"})
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            return self.send_json(400, {"error": f"invalid JSON: {str(e)}"})
+        if not isinstance(body, dict) or not isinstance(body.get("instruction"), str) or not body["instruction"].strip():
+            return self.send_json(400, {"error": "instruction is required"})
+        scheduler = self.server.scheduler
+        try:
+            job = scheduler.submit(body["instruction"].strip(), body.get("id"), body.get("domain"), body.get("url"))
+        except ValueError as e:
+            return self.send_json(409, {"error": str(e)})
+        if job is None:
+            return self.send_json(429, {"error": "queue is full"}, {"Retry-After": str(scheduler.retry_after())})
+        self.send_json(202, job.describe(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        parts, query = self.route()
+        scheduler = self.server.scheduler
+        if parts == ["metrics"]:
+            return self.send_json(200, {**scheduler.snapshot(), "metrics": metrics_sink.snapshot() if hasattr(metrics_sink, "snapshot") else {}})
+        if parts == ["jobs"]:
+            with scheduler.cond:
+                jobs = list(scheduler.jobs.values())
+            return self.send_json(200, [job.describe() for job in jobs])
+        job = scheduler.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+        if job is None or (len(parts) == 3 and parts[2] != "events"):
+            return self.send_json(404, {"error": "not found"})
+        if len(parts) == 2:
+            return self.send_json(200, job.describe())
+        try:
+            after = int(query.get("after", ["-1"])[0])
+        except ValueError:
+            return self.send_json(400, {"error": "after must be an integer"})
+        self.stream_events(job, max(0, after + 1))
+
+    def stream_events(self, job, index):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            while True:
+                with job.cond:
+                    job.cond.wait_for(lambda: len(job.events) > index or job.done, timeout=15)
+                    events = job.events[index:]
+                    finished = job.done
+                for event in events:
+                    self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                index += len(events)
+                if finished and not events:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        scheduler = self.server.scheduler
+        if len(parts) != 2 or parts[0] != "jobs" or scheduler.get(parts[1]) is None:
+            return self.send_json(404, {"error": "not found"})
+        if not scheduler.cancel(parts[1]):
+            return self.send_json(409, {"error": "job is not queued"})
+        self.send_json(200, scheduler.get(parts[1]).describe())
+
+    def log_message(self, format, *args):
+        if not self.path.startswith("/metrics"):
+            print(f"{self.address_string()} {format % args}")
+
+def serve_jobs(host=JOB_SERVER_HOST, port=JOB_SERVER_PORT, max_sessions=MAX_CONCURRENT_SESSIONS, queue_limit=JOB_QUEUE_LIMIT):
+    scheduler = JobScheduler(max_sessions, queue_limit)
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.daemon_threads = True
+    server.scheduler = scheduler
+    print(f"WePilot job server listening on http://{host}:{server.server_address[1]} with {max_sessions} sessions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping job server...")
+    finally:
+        server.server_close()
+        scheduler.shutdown()
+
+def read_batch_tasks(source):
+    stream = sys.stdin if source == "-" else open(source, 'r', encoding='utf-8')
+    tasks = []
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = line
+            if isinstance(record, str):
+                record = {"instruction": record}
+            if not isinstance(record, dict) or not record.get("instruction"):
+                print(f"Skipping line {line_number}: no instruction")
+                continue
+            record["id"] = str(record.get("id", line_number))
+            tasks.append(record)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return tasks
+
+def load_batch_checkpoint(path, retry_failed=False):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not retry_failed or record.get("status") == "completed":
+                done.add(str(record.get("id")))
+    return done
+
+def batch_record(task, result, elapsed, worker_id):
+    record = {
+        "id": task["id"],
+        "instruction": task["instruction"],
+        "status": result.get("status"),
+        "url": result.get("url", ""),
+        "actions": result.get("actions", 0),
+        "iterations": result.get("iterations", 0),
+        "llm_calls": result.get("llm_requests", 0),
+        "input_tokens": result.get("input_tokens", 0),
+        "elapsed_seconds": round(elapsed, 3),
+        "wait_seconds": result.get("wait_seconds", 0.0),
+        "timings": result.get("timings", {}),
+        "fast_path": result.get("fast_path"),
+        "worker": worker_id,
+    }
+    if result.get("error"):
+        record["error"] = result["error"]
+    return record
+
+def batch_worker(worker_id, conn, settings, log_path):
+    globals().update(settings)
+    sys.stdout = open(log_path or os.devnull, 'a', encoding='utf-8', buffering=1)
+    active = {"driver": None}
+
+    def stop(signum, frame):
+        if active["driver"] is not None:
+            try:
+                active["driver"].quit()
+            except Exception:
+                pass
+        browser_pool.close()
+        os._exit(1)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            start = time.perf_counter()
+            session = None
+            try:
+                active["driver"] = browser_pool.acquire()
+                session = AgentSession(active["driver"])
+                activate_session(session)
+                result = run_task(task["instruction"])
+            except Exception as e:
+                result = {"status": "error", "error": str(e) or type(e).__name__}
+            finally:
+                if session is not None:
+                    screenshot_writer.end_session(session.id)
+                if active["driver"] is not None:
+                    browser_pool.release(active["driver"])
+                    active["driver"] = None
+            conn.send(batch_record(task, result, time.perf_counter() - start, worker_id))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        screenshot_writer.flush()
+        browser_pool.close()
+
+def run_batch(source, output, workers=MAX_CONCURRENT_SESSIONS, timeout=600, resume=True, retry_failed=False, settings=None, log_dir=None):
+    tasks = read_batch_tasks(source)
+    done = load_batch_checkpoint(output, retry_failed) if resume else set()
+    pending = [task for task in tasks if task["id"] not in done]
+    print(f"Batch: {len(tasks)} tasks, {len(tasks) - len(pending)} already in {output}, {len(pending)} to run on {workers} workers")
+    if not pending:
+        return {}
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    context = multiprocessing.get_context("spawn")
+    pool = {}
+
+    def start_worker(worker_id):
+        parent_conn, child_conn = context.Pipe()
+        log_path = os.path.join(log_dir, f"worker-{worker_id}.log") if log_dir else None
+        process = context.Process(target=batch_worker, args=(worker_id, child_conn, settings or {}, log_path), name=f"wepilot-batch-{worker_id}", daemon=True)
+        process.start()
+        child_conn.close()
+        pool[worker_id] = {"process": process, "conn": parent_conn, "task": None, "started": None}
+
+    def stop_worker(worker_id):
+        worker = pool.pop(worker_id)
+        worker["process"].terminate()
+        worker["process"].join(10)
+        if worker["process"].is_alive():
+            worker["process"].kill()
+        worker["conn"].close()
+
+    for worker_id in range(min(workers, len(pending))):
+        start_worker(worker_id)
+
+    queue_index = 0
+    finished = 0
+    statuses = {}
+    mode = 'a' if resume else 'w'
+    with open(output, mode, encoding='utf-8') as out:
+        def write(record):
+            nonlocal finished
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            finished += 1
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+            print(f"[{finished}/{len(pending)}] {record['id']}: {record['status']} in {record['elapsed_seconds']:.1f}s")
+
+        while finished < len(pending):
+            for worker_id, worker in list(pool.items()):
+                if worker["task"] is None and queue_index < len(pending):
+                    worker["task"] = pending[queue_index]
+                    worker["started"] = time.perf_counter()
+                    worker["conn"].send(worker["task"])
+                    queue_index += 1
+
+            busy = {worker["conn"]: worker_id for worker_id, worker in pool.items() if worker["task"] is not None}
+            for conn in wait_connections(list(busy), timeout=1):
+                worker_id = busy[conn]
+                worker = pool[worker_id]
+                try:
+                    record = conn.recv()
+                except (EOFError, OSError):
+                    record = batch_record(worker["task"], {"status": "crashed", "error": "worker exited"}, time.perf_counter() - worker["started"], worker_id)
+                    stop_worker(worker_id)
+                    start_worker(worker_id)
+                else:
+                    worker["task"] = None
+                write(record)
+
+            for worker_id, worker in list(pool.items()):
+                if worker["task"] is not None and time.perf_counter() - worker["started"] > timeout:
+                    write(batch_record(worker["task"], {"status": "timeout", "error": f"exceeded {timeout}s"}, time.perf_counter() - worker["started"], worker_id))
+                    stop_worker(worker_id)
+                    start_worker(worker_id)
+
+    for worker in pool.values():
+        try:
+            worker["conn"].send(None)
+        except OSError:
+            pass
+    for worker_id in list(pool):
+        pool[worker_id]["process"].join(30)
+        stop_worker(worker_id)
+    print("Batch finished: " + ', '.join(f"{count} {status}" for status, count in sorted(statuses.items())))
+    return statuses
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="WePilot web automation agent")
+    parser.add_argument("--batch", metavar="FILE", help="run instructions from a JSONL file ('-' for stdin) instead of prompting")
+    parser.add_argument("--output", default="wepilot_results.jsonl", help="JSONL results file, also used as the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_SESSIONS, help="worker processes, each with its own browser")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a task is abandoned")
+    parser.add_argument("--restart", action="store_true", help="ignore and overwrite an existing results file")
+    parser.add_argument("--retry-failed", action="store_true", help="when resuming, rerun tasks that did not complete")
+    parser.add_argument("--headless", action="store_true", help="run browsers headless with fast-load resource blocking")
+    parser.add_argument("--pacing", choices=["humanized", "fast"], default=None)
+    parser.add_argument("--fast-path", action="store_true", help="fetch pages over plain HTTP first and only load them in Chrome when needed")
+    parser.add_argument("--log-dir", help="write each worker's output to a log file here")
+    parser.add_argument("--serve", action="store_true", help="accept tasks over a local HTTP job API")
+    parser.add_argument("--host", default=JOB_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=JOB_SERVER_PORT)
+    parser.add_argument("--queue-limit", type=int, default=JOB_QUEUE_LIMIT, help="queued jobs before new submissions are rejected with 429")
+    return parser.parse_args(argv)
+
+def main():
+    arguments = parse_arguments()
+    settings = {}
+    if arguments.headless:
+        settings["FAST_LOAD"] = True
+    if arguments.pacing:
+        settings["PACING_PROFILE"] = arguments.pacing
+    if arguments.fast_path:
+        settings["FETCH_MODE"] = "tiered"
+    if arguments.serve:
+        globals().update(settings)
+        return serve_jobs(arguments.host, arguments.port, arguments.workers, arguments.queue_limit)
+    if arguments.batch:
+        statuses = run_batch(
+            arguments.batch, arguments.output, arguments.workers, arguments.timeout,
+            resume=not arguments.restart, retry_failed=arguments.retry_failed,
+            settings=settings, log_dir=arguments.log_dir,
+        )
+        sys.exit(0 if set(statuses) <= {"completed"} else 1)
+    
+    print("Web Automation Agent started.")
+    browser_pool.warm(1)
+    
+    user_instruction = input("Enter your instruction: ")
+    
+    while user_instruction.lower() not in ["exit", "quit", "stop"]:
+        result = run_task(user_instruction)
         
-        if iteration >= max_iterations:
-            print("Maximum number of iterations reached. Task may be incomplete.")
-        
-        current_browser_state = get_browser_state()
-        
-        completion_summary = f"Completed task: {user_instruction}. Current page: {current_browser_state['title']} - {current_browser_state['url']}"
-        conversation_history.append({"role": "assistant", "content": completion_summary})
-        
-        if len(conversation_history) > 4:
-            print("\nMemory summary (last 3 tasks):")
-            for i in range(len(conversation_history)-6, len(conversation_history), 2):
-                if i >= 0:
-                    print(f"- {conversation_history[i].get('content', '')[:50]}...")
-        
-        if len(conversation_history) > 20:
-            conversation_history = conversation_history[:2] + conversation_history[-18:]
+        if result["status"] in ("error", "no_actions"):
+            if result["status"] == "error":
+                print("Please try again with a different instruction.")
+            user_instruction = input("Enter your next instruction (or type 'exit' to quit): ")
+            continue
         
-        user_instruction = input(f"Task finished. Browser is at: {current_browser_state['url']}\nEnter your next instruction (or type 'exit' to quit): ")
+        user_instruction = input(f"Task finished. Browser is at: {result['url']}\nEnter your next instruction (or type 'exit' to quit): ")
     
     print("Execution finished. Browser will remain open until you close it.")
     print("Press Ctrl+C in the terminal when you want to exit the program.")
@@ -885,7 +4240,8 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         print("\nProgram terminated by user. Closing browser...")
-        driver.quit()
+        screenshot_writer.flush()
+        current_session().driver.quit()
 
 if __name__ == "__main__":
     main()